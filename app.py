@@ -1,6 +1,21 @@
 from flask import Flask, redirect, url_for, g
 from config import Config
-from models import db, CompanyInfo, User, Venue, Client, Notification, Task, VENUES
+from models import db, CompanyInfo, Event, User, Venue, Client, Notification, Task, VENUES
+
+
+def _add_updated_at(*models):
+    """create_all() doesn't add columns to existing tables: add `updated_at`
+    where it's missing and backfill it with the creation time (or now)."""
+    for model in models:
+        table = model.__tablename__
+        columns = {c["name"] for c in db.inspect(db.engine).get_columns(table)}
+        if "updated_at" in columns:
+            continue
+        ddl = model.__table__.c.updated_at.type.compile(db.engine.dialect)
+        db.session.execute(db.text(f"ALTER TABLE {table} ADD COLUMN updated_at {ddl}"))
+        since = "coalesce(created_at, CURRENT_TIMESTAMP)" if "created_at" in columns else "CURRENT_TIMESTAMP"
+        db.session.execute(db.text(f"UPDATE {table} SET updated_at = {since}"))
+        db.session.commit()
 
 
 def create_app():
@@ -10,9 +25,14 @@ def create_app():
     # Initialize database
     db.init_app(app)
 
+    # Drop dependent cache entries whenever a commit writes to their tables
+    from services.invalidation import install as install_cache_invalidation
+    install_cache_invalidation(db.session)
+
     with app.app_context():
         try:
             db.create_all()
+            _add_updated_at(Event, CompanyInfo)
 
             # Seed company info if empty
             if not CompanyInfo.query.first():
@@ -82,6 +102,15 @@ def create_app():
                 ]
                 db.session.add_all(demo_clients)
                 db.session.commit()
+            # SQLite indexes are cheap to create; Postgres needs `flask schema indexes`
+            # and `flask search init`
+            if db.engine.dialect.name == "sqlite":
+                from services.schema import create_indexes
+                from services.search import install as install_search
+                from services.trigram import install as install_trigram
+                create_indexes()
+                install_search()
+                install_trigram()
         except Exception as e:
             print(f"[WARNING] Database init skipped: {e}")
 
@@ -131,6 +160,10 @@ def create_app():
     app.register_blueprint(tasks_bp)
     app.register_blueprint(consultas_bp)
 
+    # CLI commands (flask --app app jobs run, ...)
+    from commands import register_commands
+    register_commands(app)
+
     return app
 
 
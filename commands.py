@@ -0,0 +1,137 @@
+"""
+Flask CLI commands (run with `flask --app app <group> <command>`).
+"""
+import click
+from services import (
+    columnar, event_mentions, incremental, partitions, rollups, schema, search, sketches, tagging, trigram,
+)
+
+# Importing a job's module registers it with services.incremental
+JOB_MODULES = (rollups, tagging, event_mentions, sketches)
+
+
+def register_commands(app):
+    @app.cli.group("jobs")
+    def jobs_cli():
+        """Incremental jobs that derive tables from conversations."""
+
+    @jobs_cli.command("list")
+    def jobs_list():
+        """Show every job and its watermark."""
+        for name in incremental.jobs():
+            click.echo(f"{name}: last conversation id {incremental.watermark(name)}")
+
+    @jobs_cli.command("run")
+    @click.argument("names", nargs=-1)
+    def jobs_run(names):
+        """Catch jobs up with all new conversations (all jobs if none given)."""
+        for name in names or incremental.jobs():
+            total = incremental.run(name)
+            click.echo(f"{name}: processed {total} conversations")
+
+    @jobs_cli.command("rebuild")
+    @click.argument("names", nargs=-1)
+    def jobs_rebuild(names):
+        """Drop derived rows and backfill from the first conversation."""
+        for name in names or incremental.jobs():
+            incremental.reset(name)
+            total = incremental.run(name)
+            click.echo(f"{name}: rebuilt from {total} conversations")
+
+    @jobs_cli.command("rebuild-users")
+    def jobs_rebuild_users():
+        """Recompute conversation_users in one statement (up to the rollups watermark)."""
+        total = rollups.rebuild_users()
+        click.echo(f"conversation_users: rebuilt {total} users")
+
+    @app.cli.group("schema")
+    def schema_cli():
+        """Indexes create_all() doesn't add to existing tables."""
+
+    @schema_cli.command("indexes")
+    def schema_indexes():
+        """Create missing model indexes (CONCURRENTLY on Postgres, without blocking writes)."""
+        created = schema.create_indexes()
+        click.echo(f"Created {', '.join(created)}" if created else "Indexes already up to date")
+
+    @app.cli.group("search")
+    def search_cli():
+        """Full-text index over conversation content, trigram indexes for list filters."""
+
+    @search_cli.command("init")
+    @click.option("--rebuild", is_flag=True, help="Re-index every row (SQLite).")
+    def search_init(rebuild):
+        """Create the FTS5 / tsvector and trigram indexes and their triggers."""
+        search.install(rebuild=rebuild)
+        trigram.install(rebuild=rebuild)
+        click.echo("Full-text and trigram indexes ready")
+
+    @app.cli.group("partitions")
+    def partitions_cli():
+        """Monthly partitions and archival of the conversations table."""
+
+    @partitions_cli.command("convert")
+    @click.option("--ahead", default=partitions.MONTHS_AHEAD, show_default=True,
+                  help="Future months to create.")
+    def partitions_convert(ahead):
+        """Migrate conversations to monthly range partitions (Postgres, one-off)."""
+        try:
+            created = partitions.convert(ahead)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"conversations partitioned: {created} monthly partitions" if created
+                   else "conversations is already partitioned")
+
+    @partitions_cli.command("ensure")
+    @click.option("--ahead", default=partitions.MONTHS_AHEAD, show_default=True,
+                  help="Future months to create.")
+    def partitions_ensure(ahead):
+        """Create this month's and upcoming partitions (run monthly)."""
+        try:
+            names = partitions.ensure(ahead)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Partitions ready: {', '.join(names)}")
+
+    @partitions_cli.command("list")
+    def partitions_list():
+        """Show partitions with estimated rows and on-disk size."""
+        for p in partitions.partitions():
+            click.echo(f"{p['name']}: {p['bounds']} ~{p['rows']} rows, {p['bytes'] // 1024} KiB")
+
+    @partitions_cli.command("archive")
+    @click.option("--older-than", "months", default=12, show_default=True,
+                  help="Archive months that ended more than this many months ago.")
+    @click.option("--dir", "out_dir", default=partitions.ARCHIVE_DIR, show_default=True,
+                  help="Where the compressed archives go (Postgres).")
+    def partitions_archive(months, out_dir):
+        """Move old months out of the live conversations table."""
+        try:
+            done = partitions.archive(months, out_dir)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        for a in done:
+            click.echo(f"{a['month']}: {a['rows']} rows -> {a['path']}")
+        if not done:
+            click.echo("Nothing to archive")
+
+    @app.cli.group("export")
+    def export_cli():
+        """Offline exports for analysis."""
+
+    @export_cli.command("columnar")
+    @click.option("--dir", "out_dir", default="exports", show_default=True,
+                  help="Output directory (one sub-directory per table).")
+    @click.option("--table", "tables", multiple=True, type=click.Choice(list(columnar.TABLES)),
+                  help="Table to export (repeatable; all if omitted).")
+    @click.option("--format", "fmt", default="parquet", show_default=True,
+                  type=click.Choice(list(columnar.FORMATS)))
+    @click.option("--full", is_flag=True, help="Ignore the watermark and rewrite every partition.")
+    def export_columnar(out_dir, tables, fmt, full):
+        """Write new rows as month-partitioned Parquet / Arrow files."""
+        try:
+            results = columnar.export_all(out_dir, tables, fmt=fmt, full=full)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        for r in results:
+            click.echo(f"{r['table']}: {r['rows']} rows, {len(r['files'])} files")
@@ -100,6 +100,11 @@ class Event(db.Model):
     created_at = db.Column(
         db.DateTime, default=lambda: datetime.now(timezone.utc)
     )
+    updated_at = db.Column(  # drives the API's ETags and ?since= delta sync
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
 
     def to_dict(self):
         return {
@@ -116,6 +121,7 @@ class Event(db.Model):
             "image_url": self.image_url,
             "active": self.active,
             "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
 
 
@@ -158,6 +164,11 @@ class CompanyInfo(db.Model):
     address = db.Column(db.String(300), default="")
     hours = db.Column(db.String(200), default="")
     extra_info = db.Column(db.Text, default="")
+    updated_at = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
 
     def to_dict(self):
         return {
@@ -169,6 +180,7 @@ class CompanyInfo(db.Model):
             "address": self.address,
             "hours": self.hours,
             "extra_info": self.extra_info,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
 
 
@@ -202,6 +214,8 @@ class Conversation(db.Model):
     """Bot chat history — shared with WhatsApp bot (n8n)."""
 
     __tablename__ = "conversations"
+    # A user's history, newest first: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+    __table_args__ = (db.Index("ix_conversations_user_created", "user_id", "created_at", "id"),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(100), nullable=False, index=True)
@@ -221,6 +235,105 @@ class Conversation(db.Model):
         }
 
 
+class ConversationHourly(db.Model):
+    """Rollup: user messages per (day, hour). Maintained by services.rollups."""
+
+    __tablename__ = "conversation_hourly"
+
+    day = db.Column(db.Date, primary_key=True)
+    hour = db.Column(db.SmallInteger, primary_key=True)
+    msg_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ConversationUserDaily(db.Model):
+    """Rollup: user messages per (day, user_id). Maintained by services.rollups."""
+
+    __tablename__ = "conversation_user_daily"
+    __table_args__ = (db.Index("ix_conversation_user_daily_user_day", "user_id", "day"),)
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.String(100), primary_key=True)
+    msg_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ConversationUser(db.Model):
+    """Per-user summary of bot conversations (user messages only)."""
+
+    __tablename__ = "conversation_users"
+    # Keyset pagination of the user list: ORDER BY last_seen DESC, user_id DESC
+    __table_args__ = (db.Index("ix_conversation_users_last_seen_user", "last_seen", "user_id"),)
+
+    user_id = db.Column(db.String(100), primary_key=True)
+    msg_count = db.Column(db.Integer, nullable=False, default=0)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    days_active = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "msg_count": self.msg_count,
+            "first_seen": self.first_seen.isoformat() if self.first_seen else None,
+            "last_seen": self.last_seen.isoformat() if self.last_seen else None,
+            "days_active": self.days_active,
+        }
+
+
+class ConversationUserSketch(db.Model):
+    """HyperLogLog sketch of the users who wrote on a day (services.sketches)."""
+
+    __tablename__ = "conversation_user_sketches"
+
+    day = db.Column(db.Date, primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+
+class ConversationTag(db.Model):
+    """Write-time topic tag for a conversation row (services.tagging)."""
+
+    __tablename__ = "conversation_tags"
+    __table_args__ = (db.Index("ix_conversation_tags_tag_user", "tag", "user_id"),)
+
+    tag = db.Column(db.String(30), primary_key=True)
+    conversation_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(100), nullable=False)
+
+
+class EventMention(db.Model):
+    """A user message that mentions an event by name (services.event_mentions)."""
+
+    __tablename__ = "event_mentions"
+    __table_args__ = (db.Index("ix_event_mentions_event_day", "event_id", "day"),)
+
+    event_id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.Date, nullable=True)
+
+
+class EventMentionBackfill(db.Model):
+    """An event created or renamed after part of the history was indexed; the
+    event_mentions job scans conversations (done_id, until_id] for it in chunks."""
+
+    __tablename__ = "event_mention_backfill"
+
+    event_id = db.Column(db.Integer, primary_key=True)
+    done_id = db.Column(db.Integer, nullable=False, default=0)
+    until_id = db.Column(db.Integer, nullable=False)
+
+
+class JobWatermark(db.Model):
+    """Last conversations.id processed by an incremental job (services.incremental)."""
+
+    __tablename__ = "job_watermarks"
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(
+        db.DateTime, default=lambda: datetime.now(timezone.utc)
+    )
+
+
 class Client(db.Model):
     """Client registered via bot."""
     __tablename__ = "clients"
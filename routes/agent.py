@@ -1,25 +1,26 @@
-from flask import Blueprint, render_template, request
-from models import db, CompanyInfo, Conversation, Event, Venue
+from flask import Blueprint, render_template, request, jsonify
+from models import CompanyInfo, Conversation, Event, Venue
 from routes.auth import login_required
+from services import pagination, rollups, trigram
+from services.cache import cached
 
 agent_bp = Blueprint("agent", __name__)
+TYPEAHEAD_LIMIT = 10
+
+
+def _counters():
+    return {"messages_total": rollups.total_messages(), "unique_users": rollups.distinct_users()}
 
 
 @agent_bp.route("/agente")
 @login_required
 def index():
     company = CompanyInfo.query.first()
-    messages_total = Conversation.query.filter_by(role="user").count()
-
-    # All unique users who have spoken with the bot (for selector)
-    user_ids = [
-        r[0] for r in db.session.query(db.func.distinct(Conversation.user_id))
-        .order_by(Conversation.user_id).all()
-    ]
+    counters = cached("agent:counters", _counters, ttl=60, stale_ttl=300, depends_on=("conversations",))
 
     # Selected user (default: most recent)
     selected_user = request.args.get("user_id")
-    if not selected_user and user_ids:
+    if not selected_user:
         # Pick the user with the most recent message
         latest = (
             Conversation.query.filter_by(role="user")
@@ -41,18 +42,31 @@ def index():
     # Data for interactive capability items
     active_events = Event.query.filter_by(active=True).order_by(Event.date).all()
     active_venues = Venue.query.filter_by(active=True).order_by(Venue.name).all()
-    unique_users = len(user_ids)
     events_with_links = [e for e in active_events if e.entry_link]
 
     return render_template(
         "agente.html",
         company=company,
-        messages_total=messages_total,
+        messages_total=counters["messages_total"],
         recent_messages=recent_messages,
-        user_ids=user_ids,
         selected_user=selected_user,
         active_events=active_events,
         active_venues=active_venues,
-        unique_users=unique_users,
+        unique_users=counters["unique_users"],
         events_with_links=events_with_links,
     )
+
+
+@agent_bp.route("/agente/usuarios")
+@login_required
+def user_typeahead():
+    """Users whose id contains ?q=, most recently active first (typeahead)."""
+    q = request.args.get("q", "").strip()
+    limit = pagination.page_size(request.args.get("limit", type=int), TYPEAHEAD_LIMIT)
+    user_filter = (lambda col: trigram.contains(q, col)) if q else None
+    users, _ = rollups.user_page(limit, user_filter=user_filter)
+    return jsonify([
+        {"user_id": u["user_id"], "msg_count": u["msg_count"],
+         "last_active": u["last_active"].strftime("%d/%m %H:%M") if u["last_active"] else ""}
+        for u in users
+    ])
@@ -1,8 +1,12 @@
 from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from functools import wraps
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, make_response
 from models import db, Event, Message, CompanyInfo, Client
 from services.notifications import notify_birthday_greeted, notify_new_client
+from services.event_mentions import queue_reindex
+from services import ingest, write_behind
+from services.http_cache import table_version, versioned_json
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 
@@ -20,21 +24,59 @@ def require_api_key(f):
 
 # ─── Events ──────────────────────────────────────────
 
+def _since():
+    """?since= as naive UTC (the columns' convention); ValueError if malformed.
+
+    Either ISO 8601 — exact, e.g. a previous response's X-Next-Since — or an
+    HTTP-date such as a previous Last-Modified. HTTP-dates have whole
+    seconds, so rows changed later within that second are sent again.
+    """
+    value = request.args.get("since")
+    if not value:
+        return None
+    if value[:1].isdigit():
+        if "T" in value:  # an unescaped "+02:00" offset arrives as " 02:00"
+            value = value.replace(" ", "+")
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    else:
+        ts = parsedate_to_datetime(value)
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+
+_SINCE_ERROR = "'since' is not an ISO 8601 timestamp or HTTP-date"
+
+
 @api_bp.route("/events", methods=["GET"])
 @require_api_key
 def get_events():
+    """Events as a list; with ?since= only what changed after it, as
+    {"events": [changed], "ids": [every current id], "updated_at"} so clients
+    can also drop deleted (or, without ?all=true, deactivated) events.
+    "updated_at" (also the X-Next-Since header) is the next exact ?since=."""
     show_all = request.args.get("all", "false").lower() == "true"
+    try:
+        since = _since()
+    except ValueError:
+        return jsonify({"error": _SINCE_ERROR}), 400
+    version = table_version(Event)
+
+    def build():
+        if show_all:
+            query = Event.query.order_by(Event.date.desc())
+        else:
+            query = Event.query.filter_by(active=True).order_by(Event.date.asc())
+        if since is None:
+            return [e.to_dict() for e in query.all()]
+        changed = query.filter(Event.updated_at > since).all()
+        ids = [i for (i,) in query.with_entities(Event.id)]
+        updated = version[1]
+        return {
+            "events": [e.to_dict() for e in changed],
+            "ids": ids,
+            "updated_at": updated.isoformat() if updated else None,
+        }
 
-    if show_all:
-        events = Event.query.order_by(Event.date.desc()).all()
-    else:
-        events = (
-            Event.query.filter_by(active=True)
-            .order_by(Event.date.asc())
-            .all()
-        )
-
-    return jsonify([e.to_dict() for e in events])
+    return versioned_json(version, build)
 
 
 @api_bp.route("/events", methods=["POST"])
@@ -59,6 +101,8 @@ def create_event():
             active=data.get("active", True),
         )
         db.session.add(event)
+        db.session.flush()
+        queue_reindex(event.id)
         db.session.commit()
         return jsonify(event.to_dict()), 201
     except Exception as e:
@@ -74,6 +118,8 @@ def log_message():
     data = request.get_json()
     if not data:
         return jsonify({"error": "No data provided"}), 400
+    if write_behind.ENABLED:
+        return _queue_message(data)
 
     try:
         msg = Message(
@@ -94,6 +140,53 @@ def log_message():
         return jsonify({"error": str(e)}), 400
 
 
+def _queue_message(data):
+    """Write-behind mode: validate now, acknowledge with 202, commit in the next group."""
+    rows, errors = ingest.validate("messages", [(0, data, None)])
+    if errors:
+        return jsonify({"error": errors[0]["error"]}), 400
+    try:
+        write_behind.submit(current_app._get_current_object(), rows[0])
+    except write_behind.QueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+    return jsonify({"status": "queued"}), 202
+
+
+def _batch(target):
+    """Validate a JSON-array / NDJSON body and insert its valid rows in one go."""
+    if (request.content_length or 0) > ingest.MAX_BYTES:
+        return jsonify({"error": f"Batch larger than {ingest.MAX_BYTES // (1024 * 1024)} MB"}), 413
+    try:
+        items = ingest.parse(request.get_data(cache=False), request.content_type)
+    except ingest.BatchError as e:
+        return jsonify({"error": str(e)}), e.status
+    rows, errors = ingest.validate(target, items)
+    if errors and request.args.get("atomic", "").lower() in ("1", "true", "yes"):
+        return jsonify({"inserted": 0, "rejected": len(errors), "errors": errors}), 422
+    try:
+        inserted = ingest.insert(target, rows)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    status = 201 if not errors else 207 if inserted else 422
+    return jsonify({"inserted": inserted, "rejected": len(errors), "errors": errors}), status
+
+
+@api_bp.route("/messages/batch", methods=["POST"])
+@require_api_key
+def log_messages_batch():
+    """Many messages at once (JSON array or NDJSON); invalid rows are reported, not inserted."""
+    return _batch("messages")
+
+
+@api_bp.route("/conversations/batch", methods=["POST"])
+@require_api_key
+def log_conversations_batch():
+    """Bot turns (user_id, role, content, created_at) in bulk, e.g. to backfill history."""
+    return _batch("conversations")
+
+
 @api_bp.route("/messages", methods=["GET"])
 @require_api_key
 def get_messages():
@@ -120,16 +213,17 @@ def message_stats():
     week_start = today_start - timedelta(days=now.weekday())
     month_start = today_start.replace(day=1)
 
-    return jsonify(
-        {
-            "today": Message.query.filter(Message.timestamp >= today_start).count(),
-            "this_week": Message.query.filter(Message.timestamp >= week_start).count(),
-            "this_month": Message.query.filter(
-                Message.timestamp >= month_start
-            ).count(),
-            "total": Message.query.count(),
-        }
-    )
+    stats = {
+        "today": Message.query.filter(Message.timestamp >= today_start).count(),
+        "this_week": Message.query.filter(Message.timestamp >= week_start).count(),
+        "this_month": Message.query.filter(
+            Message.timestamp >= month_start
+        ).count(),
+        "total": Message.query.count(),
+    }
+    if write_behind.ENABLED:
+        stats["write_behind"] = write_behind.stats()
+    return jsonify(stats)
 
 
 # ─── Company Info ────────────────────────────────────
@@ -137,10 +231,22 @@ def message_stats():
 @api_bp.route("/company-info", methods=["GET"])
 @require_api_key
 def get_company_info():
-    company = CompanyInfo.query.first()
-    if not company:
-        return jsonify({"error": "No company info found"}), 404
-    return jsonify(company.to_dict())
+    """Company info; with ?since= a 204 if it hasn't changed after it (send
+    the X-Next-Since header back as the next ?since=)."""
+    try:
+        since = _since()
+    except ValueError:
+        return jsonify({"error": _SINCE_ERROR}), 400
+
+    def build():
+        company = CompanyInfo.query.first()
+        if not company:
+            return make_response(jsonify({"error": "No company info found"}), 404)
+        if since is not None and company.updated_at and company.updated_at <= since:
+            return make_response("", 204)
+        return company.to_dict()
+
+    return versioned_json(table_version(CompanyInfo), build)
 
 
 @api_bp.route("/company-info", methods=["PUT"])
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from models import db, Client
 from routes.auth import login_required
+from services import trigram
 from services.activity import log_activity
 
 clients_bp = Blueprint("clients", __name__)
@@ -15,13 +16,7 @@ def index():
     query = Client.query
 
     if search:
-        query = query.filter(
-            db.or_(
-                Client.name.ilike(f"%{search}%"),
-                Client.phone.ilike(f"%{search}%"),
-                Client.chat_id.ilike(f"%{search}%"),
-            )
-        )
+        query = query.filter(trigram.contains(search, Client.name, Client.phone, Client.chat_id))
 
     if status_filter:
         query = query.filter_by(status=status_filter)
@@ -1,10 +1,14 @@
-from flask import Blueprint, render_template, request
-from models import Conversation
+from flask import Blueprint, render_template, request, jsonify, abort, url_for
+from models import db, Conversation
 from routes.auth import login_required
+from services import incremental, pagination, rollups
 from datetime import datetime, timezone
 
 consultas_bp = Blueprint("consultas", __name__)
 
+PER_PAGE = 20
+ANSWER_CHARS = 300  # the list shows a preview; one extra char marks truncation
+
 
 def _time_ago(dt, now):
     if not dt:
@@ -20,82 +24,86 @@ def _time_ago(dt, now):
     return f"{diff.days}d"
 
 
-@consultas_bp.route("/consultas")
-@login_required
-def index():
-    page = request.args.get("page", 1, type=int)
-    per_page = 20
-    now = datetime.now(timezone.utc)
+def _pairs(after=None, limit=PER_PAGE):
+    """Newest user questions before `after` (created_at, id), each with the
+    first bot reply that followed it. Returns (pairs, cursor of the next page).
 
-    # 1 query: total count
-    total = Conversation.query.filter_by(role="user").count()
-    total_pages = (total + per_page - 1) // per_page
-
-    # 1 query: user messages for this page
-    user_msgs = (
-        Conversation.query.filter_by(role="user")
-        .order_by(Conversation.created_at.desc())
-        .offset((page - 1) * per_page)
-        .limit(per_page)
-        .all()
+    The reply is a "first assistant message after" lookup per question — a
+    LATERAL join on Postgres, a correlated subquery elsewhere — so only
+    `limit` + 1 questions and at most one reply each are read.
+    """
+    Q = db.aliased(Conversation, name="q")
+    A = db.aliased(Conversation, name="a")
+    reply = (
+        db.select(db.func.substr(A.content, 1, ANSWER_CHARS + 1).label("answer"))
+        .where(A.user_id == Q.user_id, A.role == "assistant", A.created_at > Q.created_at)
+        .order_by(A.created_at, A.id)
+        .limit(1)
     )
+    if db.engine.dialect.name == "postgresql":
+        reply = reply.lateral("reply")
+        stmt = (
+            db.select(Q.id, Q.user_id, Q.content, Q.created_at, reply.c.answer)
+            .outerjoin(reply, db.true())
+        )
+    else:
+        stmt = db.select(Q.id, Q.user_id, Q.content, Q.created_at, reply.scalar_subquery().label("answer"))
 
-    if not user_msgs:
-        return render_template("consultas.html", pairs=[], page=page,
-                               total_pages=total_pages, total=total)
-
-    # 1 query: get the first bot reply after each user message
-    # Uses a lateral/correlated subquery via raw SQL for efficiency
-    # Fallback: fetch all assistant messages for these users in the time window
-    user_ids = list({m.user_id for m in user_msgs})
-    min_ts = min(m.created_at for m in user_msgs if m.created_at)
+    stmt = stmt.where(Q.role == "user")
+    if after is not None:
+        stmt = stmt.where(db.tuple_(Q.created_at, Q.id) < db.tuple_(*after))
+    rows = db.session.execute(
+        stmt.order_by(Q.created_at.desc(), Q.id.desc()).limit(limit + 1)
+    ).all()
 
-    bot_msgs = (
-        Conversation.query
-        .filter(
-            Conversation.role == "assistant",
-            Conversation.user_id.in_(user_ids),
-            Conversation.created_at >= min_ts,
-        )
-        .order_by(Conversation.created_at.asc())
-        .all()
-    )
+    now = datetime.now(timezone.utc)
+    pairs = [
+        {
+            "user_id": r.user_id,
+            "question": r.content,
+            "answer": r.answer,
+            "ago": _time_ago(r.created_at, now),
+            "ts": r.created_at.strftime("%d/%m %H:%M") if r.created_at else "",
+        }
+        for r in rows[:limit]
+    ]
+    cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        cursor = pagination.encode_cursor(last.created_at, last.id)
+    return pairs, cursor
 
-    # Index bot replies by user_id for O(1) lookup
-    # Keep the first bot reply after each user message
-    bot_by_user: dict[str, list] = {}
-    for b in bot_msgs:
-        bot_by_user.setdefault(b.user_id, []).append(b)
 
-    pairs = []
-    for msg in user_msgs:
-        # Find first bot reply after this message
-        answer = None
-        for b in bot_by_user.get(msg.user_id, []):
-            b_ts = b.created_at
-            m_ts = msg.created_at
-            if b_ts and m_ts:
-                b_cmp = b_ts if b_ts.tzinfo else b_ts
-                m_cmp = m_ts if m_ts.tzinfo else m_ts
-                try:
-                    if b_cmp > m_cmp:
-                        answer = b.content
-                        break
-                except TypeError:
-                    pass
+def _page():
+    after = None
+    if request.args.get("cursor"):
+        try:
+            after = pagination.decode_cursor(request.args["cursor"], 2)
+        except ValueError:
+            abort(400, "Cursor inválido")
+    pairs, cursor = _pairs(after)
+    return pairs, url_for("consultas.page", cursor=cursor) if cursor else None
 
-        pairs.append({
-            "user_id": msg.user_id,
-            "question": msg.content,
-            "answer": answer,
-            "ago": _time_ago(msg.created_at, now),
-            "ts": msg.created_at.strftime("%d/%m %H:%M") if msg.created_at else "",
-        })
 
+@consultas_bp.route("/consultas")
+@login_required
+def index():
+    incremental.catch_up()
+    pairs, next_url = _page()
     return render_template(
         "consultas.html",
         pairs=pairs,
-        page=page,
-        total_pages=total_pages,
-        total=total,
+        next_url=next_url,
+        total=rollups.total_messages(),
     )
+
+
+@consultas_bp.route("/consultas/pagina")
+@login_required
+def page():
+    """Next 20 pairs (infinite scroll): rendered items + URL of the page after."""
+    pairs, next_url = _page()
+    return jsonify({
+        "html": render_template("consultas_items.html", pairs=pairs),
+        "next": next_url,
+    })
@@ -1,76 +1,209 @@
-from datetime import datetime
-from flask import Blueprint, render_template, request
-from models import db, Conversation
+from datetime import datetime, timedelta
+from itertools import chain
+from flask import Blueprint, render_template, request, jsonify, abort, url_for
+from models import db, Conversation, ConversationUser
 from routes.auth import login_required
+from services import incremental, pagination, partitions, rollups, trigram
+from services import search as fts
+from services.export import csv_response, stream_query
 
 conversations_bp = Blueprint("conversations", __name__)
 
+DETAIL_WINDOW = 100  # newest messages rendered with the conversation page
+
+
+def _user_filter(search):
+    """user_id contains the search (trigram index), or the user wrote a message
+    matching the full-text index."""
+    if not search:
+        return None
+    matching = fts.matching_user_ids(search)
+    return lambda col: db.or_(trigram.contains(search, col), col.in_(matching))
+
+
+def _user_page(search):
+    """Rows of the user list after ?cursor=, plus the cursor of the next page."""
+    after = None
+    if request.args.get("cursor"):
+        try:
+            after = pagination.decode_cursor(request.args["cursor"], 2)
+        except ValueError:
+            abort(400, "Cursor inválido")
+    limit = pagination.page_size(request.args.get("limit", type=int))
+    users, has_more = rollups.user_page(limit, after=after, user_filter=_user_filter(search))
+    next_cursor = (
+        pagination.encode_cursor(users[-1]["last_active"], users[-1]["user_id"])
+        if has_more else None
+    )
+    return users, next_cursor
+
+
+def _next_url(search, cursor):
+    if not cursor:
+        return None
+    return url_for("conversations.users_page", cursor=cursor, search=search or None)
+
 
 @conversations_bp.route("/conversaciones")
 @login_required
 def index():
     search = request.args.get("search", "").strip()
+    incremental.catch_up()
+    users, next_cursor = _user_page(search)
 
-    base_query = (
-        db.session.query(
-            Conversation.user_id,
-            db.func.count(Conversation.id).label("msg_count"),
-            db.func.max(Conversation.created_at).label("last_active"),
-            db.func.min(Conversation.created_at).label("first_seen"),
+    hits = []
+    if search:
+        hits = fts.search(search, limit=10)
+        user_filter = _user_filter(search)
+        total, capped = pagination.capped_count(
+            db.select(ConversationUser.user_id).where(user_filter(ConversationUser.user_id))
         )
-        .filter(Conversation.role == "user")
-        .group_by(Conversation.user_id)
+    else:
+        total, capped = pagination.estimate_count(ConversationUser), False
+
+    return render_template(
+        "conversaciones.html", users=users, search=search, hits=hits,
+        total=total, total_capped=capped, next_url=_next_url(search, next_cursor),
     )
 
-    if search:
-        user_ids_with_content = (
-            db.session.query(Conversation.user_id)
-            .filter(
-                Conversation.role == "user",
-                Conversation.content.ilike(f"%{search}%"),
-            )
-            .distinct()
-            .subquery()
-        )
-        base_query = base_query.filter(
-            db.or_(
-                Conversation.user_id.ilike(f"%{search}%"),
-                Conversation.user_id.in_(db.select(user_ids_with_content.c.user_id)),
-            )
-        )
 
-    users = base_query.order_by(db.text("last_active DESC")).all()
+@conversations_bp.route("/conversaciones/usuarios")
+@login_required
+def users_page():
+    """Next page of the user list (infinite scroll): rendered rows + next page URL."""
+    search = request.args.get("search", "").strip()
+    users, next_cursor = _user_page(search)
+    return jsonify({
+        "html": render_template("conversaciones_filas.html", users=users),
+        "next": _next_url(search, next_cursor),
+    })
 
-    return render_template("conversaciones.html", users=users, search=search)
 
+@conversations_bp.route("/conversaciones/buscar")
+@login_required
+def search_messages():
+    """Ranked full-text search over messages with highlighted snippets."""
+    q = request.args.get("q", "").strip()
+    limit = min(request.args.get("limit", 20, type=int), 100)
+    role = request.args.get("role", "user") or None
+    hits = fts.search(q, limit=limit, role=role)
+    return jsonify({
+        "query": q,
+        "indexed": fts.available(),
+        "results": [
+            dict(h, snippet=str(h["snippet"]),
+                 created_at=h["created_at"].isoformat() if h["created_at"] else None)
+            for h in hits
+        ],
+    })
 
-@conversations_bp.route("/conversaciones/<user_id>")
+
+@conversations_bp.route("/conversaciones/export/csv")
 @login_required
-def detail(user_id):
-    date_from = request.args.get("from", "").strip()
-    date_to = request.args.get("to", "").strip()
+def export_csv():
+    """Raw message history, optionally limited to [desde, hasta] (YYYY-MM-DD)."""
+    try:
+        since = request.args.get("desde", "").strip()
+        until = request.args.get("hasta", "").strip()
+        since = datetime.strptime(since, "%Y-%m-%d") if since else None
+        until = datetime.strptime(until, "%Y-%m-%d") + timedelta(days=1) if until else None
+    except ValueError:
+        abort(400, "Fecha inválida, usa el formato AAAA-MM-DD")
+
+    query = Conversation.query
+    if since:
+        query = query.filter(Conversation.created_at >= since)
+    if until:
+        query = query.filter(Conversation.created_at < until)
+    user_id = request.args.get("user_id", "").strip()
+    if user_id:
+        query = query.filter(Conversation.user_id == user_id)
 
-    query = Conversation.query.filter_by(user_id=user_id)
+    # Archived months come first, then the live table
+    archived = partitions.archived_rows(since, until, user_id or None)
+    live = (
+        (m.id, m.user_id, m.role, m.content, m.created_at)
+        for m in stream_query(query.order_by(Conversation.created_at.asc(), Conversation.id.asc()))
+    )
+    rows = (
+        [id_, uid, role, content, created.strftime("%Y-%m-%d %H:%M:%S") if created else ""]
+        for id_, uid, role, content, created in chain(archived, live)
+    )
+    suffix = "_".join(p for p in (request.args.get("desde"), request.args.get("hasta")) if p)
+    return csv_response(
+        f"conversaciones{'_' + suffix if suffix else ''}.csv",
+        ["ID", "Usuario", "Rol", "Mensaje", "Fecha"],
+        rows,
+    )
 
+
+def _history_filter(user_id):
+    """Filters for a user's messages within the ?from= / ?to= dates (if valid)."""
+    filters = [Conversation.user_id == user_id]
+    date_from = request.args.get("from", "").strip()
+    date_to = request.args.get("to", "").strip()
     if date_from:
         try:
-            query = query.filter(Conversation.created_at >= datetime.fromisoformat(date_from))
+            filters.append(Conversation.created_at >= datetime.fromisoformat(date_from))
         except ValueError:
             pass
     if date_to:
         try:
-            query = query.filter(Conversation.created_at <= datetime.fromisoformat(date_to + "T23:59:59"))
+            filters.append(Conversation.created_at <= datetime.fromisoformat(date_to + "T23:59:59"))
         except ValueError:
             pass
+    return filters
+
+
+def _message_window(user_id, filters):
+    """Messages before ?before= (newest first in SQL, returned oldest first) + next URL."""
+    query = Conversation.query.filter(*filters)
+    if request.args.get("before"):
+        try:
+            before = pagination.decode_cursor(request.args["before"], 2)
+        except ValueError:
+            abort(400, "Cursor inválido")
+        query = query.filter(db.tuple_(Conversation.created_at, Conversation.id) < db.tuple_(*before))
+    limit = pagination.page_size(request.args.get("limit", type=int), DETAIL_WINDOW)
+    rows = query.order_by(Conversation.created_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+    messages = rows[:limit][::-1]
+    next_url = None
+    if len(rows) > limit:
+        next_url = url_for(
+            "conversations.messages_page", user_id=user_id,
+            before=pagination.encode_cursor(messages[0].created_at, messages[0].id),
+            **{k: request.args[k] for k in ("from", "to") if request.args.get(k, "").strip()},
+        )
+    return messages, next_url
 
-    messages = query.order_by(Conversation.created_at.asc()).all()
-    msg_count = sum(1 for m in messages if m.role == "user")
+
+@conversations_bp.route("/conversaciones/<user_id>")
+@login_required
+def detail(user_id):
+    filters = _history_filter(user_id)
+    messages, older_url = _message_window(user_id, filters)
+    msg_count = (
+        db.session.query(db.func.count(Conversation.id))
+        .filter(*filters, Conversation.role == "user").scalar()
+    )
 
     return render_template(
         "conversacion_detalle.html",
         user_id=user_id,
         messages=messages,
         msg_count=msg_count,
-        date_from=date_from,
-        date_to=date_to,
+        older_url=older_url,
+        date_from=request.args.get("from", "").strip(),
+        date_to=request.args.get("to", "").strip(),
     )
+
+
+@conversations_bp.route("/conversaciones/<user_id>/mensajes")
+@login_required
+def messages_page(user_id):
+    """Older messages (scrolling up): rendered bubbles + URL of the page before them."""
+    messages, older_url = _message_window(user_id, _history_filter(user_id))
+    return jsonify({
+        "html": render_template("conversacion_mensajes.html", messages=messages),
+        "next": older_url,
+    })
@@ -1,139 +1,73 @@
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta, timezone
 from flask import Blueprint, render_template
-from sqlalchemy import or_
-from models import db, Event, Conversation
+from models import Event, Conversation
+from routes import widgets
 from routes.auth import login_required
-from services.cache import cached as _cached
-
-RRPP_KEYWORDS = [
-    'rrpp', 'promotor', 'promotora', 'comision', 'comisiones',
-    'ganar dinero', 'equipo', 'reclutar', 'relaciones publicas',
-    'codigo', 'enlace', 'rangos', 'puntos', 'ser rrpp',
-    'quiero ser', 'trabajar', 'sueldo', 'beneficios'
-]
+from services import rollups, fanout
 
 dashboard_bp = Blueprint("dashboard", __name__)
+RECENT_DAYS = 31  # activity feed window: at most the last two monthly partitions
 
 
-def _time_ago(dt, now):
+def _iso_utc(dt):
     if not dt:
-        return ""
-    diff = (now - dt) if dt.tzinfo else (now.replace(tzinfo=None) - dt)
-    s = int(diff.total_seconds())
-    if s < 60:
-        return f"{s}s"
-    if s < 3600:
-        return f"{s // 60}m"
-    if s < 86400:
-        return f"{s // 3600}h"
-    return f"{diff.days}d"
+        return None
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).isoformat()
 
 
-@dashboard_bp.route("/")
-@dashboard_bp.route("/dashboard")
-@login_required
-def index():
-    now = datetime.now(timezone.utc)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+# ── Widgets (routes.widgets) ─────────────────────────────────
+
+def _kpis():
+    now, today_start = widgets.bounds()
     week_start = today_start - timedelta(days=now.weekday())
     month_start = today_start.replace(day=1)
+    r = fanout.run({
+        # All message KPIs — rollups + not-yet-rolled-up tail
+        "totals": lambda: rollups.message_totals(today_start, week_start, month_start),
+        "active": lambda: Event.query.filter_by(active=True).count(),
+        "events": lambda: Event.query.count(),
+        "users": rollups.distinct_users,
+    })
+    today, week, month, total = r["totals"]
+    return {
+        "messages_today": today, "messages_week": week,
+        "messages_month": month, "messages_total": total,
+        "active_events": r["active"], "total_events": r["events"],
+        "total_users": r["users"],
+    }
+
+
+def _daily():
+    # Daily messages chart — ~30 rollup rows
+    _, today_start = widgets.bounds()
     thirty_days_ago = today_start - timedelta(days=30)
+    daily_map = rollups.daily_counts(thirty_days_ago)
+    return {"daily_messages": [
+        {"date": (thirty_days_ago + timedelta(days=i)).strftime("%d/%m"),
+         "count": daily_map.get((thirty_days_ago + timedelta(days=i)).strftime("%Y-%m-%d"), 0)}
+        for i in range(30)
+    ]}
 
-    # ── Fast queries (run every request) ──────────────────────────────────────
-
-    # All message KPIs in ONE query
-    row = db.session.query(
-        db.func.count(Conversation.id).filter(Conversation.created_at >= today_start),
-        db.func.count(Conversation.id).filter(Conversation.created_at >= week_start),
-        db.func.count(Conversation.id).filter(Conversation.created_at >= month_start),
-        db.func.count(Conversation.id),
-    ).filter(Conversation.role == "user").one()
-    messages_today, messages_week, messages_month, messages_total = row
 
-    # Events: active count + upcoming + total
-    all_active = Event.query.filter_by(active=True).order_by(Event.date.asc()).all()
-    active_events = len(all_active)
+def _activity():
+    now, _ = widgets.bounds()
     now_naive = now.replace(tzinfo=None)
-    upcoming_events = [
+    all_active = Event.query.filter_by(active=True).order_by(Event.date.asc()).all()
+    upcoming = [
         e for e in all_active
         if e.date and (
             (e.date.replace(tzinfo=None) if getattr(e.date, 'tzinfo', None) else e.date) >= now_naive
         )
     ][:5]
-    total_events = Event.query.count()
 
-    # Recent user messages for activity feed (fast, indexed)
+    # Recent user messages for activity feed. The created_at bound lets a
+    # partitioned table skip every month but the last ones.
+    recent = Conversation.query.filter_by(role="user").order_by(Conversation.created_at.desc())
     recent_messages = (
-        Conversation.query.filter_by(role="user")
-        .order_by(Conversation.created_at.desc())
-        .limit(20)
-        .all()
-    )
-
-    # Daily messages chart — 1 GROUP BY query
-    daily_rows = (
-        db.session.query(
-            db.func.date(Conversation.created_at).label("day"),
-            db.func.count(Conversation.id),
-        )
-        .filter(Conversation.role == "user", Conversation.created_at >= thirty_days_ago)
-        .group_by("day")
-        .all()
+        recent.filter(Conversation.created_at >= now_naive - timedelta(days=RECENT_DAYS)).limit(20).all()
+        or recent.limit(20).all()
     )
-    daily_map = {str(r[0]): r[1] for r in daily_rows}
-    daily_messages = [
-        {"date": (thirty_days_ago + timedelta(days=i)).strftime("%d/%m"),
-         "count": daily_map.get((thirty_days_ago + timedelta(days=i)).strftime("%Y-%m-%d"), 0)}
-        for i in range(30)
-    ]
 
-    # Hourly messages chart — 1 GROUP BY query
-    hourly_rows = (
-        db.session.query(
-            db.extract("hour", Conversation.created_at).label("h"),
-            db.func.count(Conversation.id),
-        )
-        .filter(Conversation.role == "user")
-        .group_by("h")
-        .all()
-    )
-    hourly_map = {int(r[0]): r[1] for r in hourly_rows}
-    hourly_messages = [{"hour": f"{h:02d}:00", "count": hourly_map.get(h, 0)} for h in range(24)]
-
-    # ── Slow/heavy analytics — cached 5 minutes ───────────────────────────────
-
-    def _get_user_stats():
-        total_u = (
-            db.session.query(db.func.count(db.func.distinct(Conversation.user_id)))
-            .filter(Conversation.role == "user")
-            .scalar()
-        ) or 0
-
-        keyword_filters = [Conversation.content.ilike(f'%{kw}%') for kw in RRPP_KEYWORDS]
-        rrpp_u = (
-            db.session.query(db.func.count(db.func.distinct(Conversation.user_id)))
-            .filter(Conversation.role == "user", or_(*keyword_filters))
-            .scalar()
-        ) or 0
-
-        returning_u = (
-            db.session.query(db.func.count())
-            .select_from(
-                db.session.query(Conversation.user_id)
-                .filter(Conversation.role == "user")
-                .group_by(Conversation.user_id)
-                .having(db.func.count(Conversation.id) > 1)
-                .subquery()
-            )
-        ).scalar() or 0
-
-        return total_u, rrpp_u, returning_u
-
-    total_users, rrpp_users, returning_users = _cached("user_stats", _get_user_stats, ttl=300)
-    rrpp_interest_rate = round((rrpp_users / total_users) * 100, 1) if total_users else 0
-    retention_rate = round((returning_users / total_users) * 100, 1) if total_users else 0
-
-    # ── Activity feed ─────────────────────────────────────────────────────────
     feed_items = []
     seen_users: set = set()
     for m in recent_messages:
@@ -145,7 +79,8 @@ def index():
             "label": "Consulta resuelta",
             "desc": m.content[:70] + ("…" if len(m.content) > 70 else ""),
             "link": f"/conversaciones/{m.user_id}",
-            "ago": _time_ago(m.created_at, now),
+            # Relative time is rendered client-side so the ETag stays stable
+            "at": _iso_utc(m.created_at),
         })
 
     for e in all_active[:5]:
@@ -154,26 +89,34 @@ def index():
             "label": "Fiesta activa",
             "desc": f"{e.name} — {e.venue}" + (f" · {e.date.strftime('%d/%m/%Y')}" if e.date else ""),
             "link": "/fiestas",
-            "ago": "",
+            "at": None,
         })
 
-    feed_items = feed_items[:12]
-
-    return render_template(
-        "dashboard.html",
-        messages_today=messages_today,
-        messages_week=messages_week,
-        messages_month=messages_month,
-        messages_total=messages_total,
-        active_events=active_events,
-        total_events=total_events,
-        upcoming_events=upcoming_events,
-        recent_activity=feed_items,
-        daily_messages=daily_messages,
-        hourly_messages=hourly_messages,
-        total_users=total_users,
-        rrpp_users=rrpp_users,
-        rrpp_interest_rate=rrpp_interest_rate,
-        retention_rate=retention_rate,
-        returning_users=returning_users,
-    )
+    return {
+        "recent_activity": feed_items[:12],
+        "upcoming_events": [
+            {"name": e.name, "venue": e.venue, "theme": e.theme,
+             "day": e.date.strftime("%d"), "month": e.date.strftime("%b")}
+            for e in upcoming
+        ],
+    }
+
+
+WIDGETS = {
+    "kpis": widgets.Widget(_kpis, 30, 120, 15, ("conversations", "events")),
+    "daily": widgets.Widget(_daily, 120, 600, 60, ("conversations",)),
+    "hourly": widgets.Widget(widgets.hourly, 300, 900, 120, ("conversations",)),
+    "activity": widgets.Widget(_activity, 15, 60, 10, ("conversations", "events")),
+    # Slow/heavy analytics — cached 5 minutes, refreshed in background
+    "retention": widgets.Widget(rollups.funnel, 300, 900, 120, ("conversations",)),
+}
+widgets.add_routes(dashboard_bp, "/dashboard", WIDGETS)
+
+
+@dashboard_bp.route("/")
+@dashboard_bp.route("/dashboard")
+@login_required
+def index():
+    # Shell only: every figure is loaded from /dashboard/data/<widget>
+    return render_template("dashboard.html")
+
@@ -1,12 +1,13 @@
-import csv
-import io
 import calendar as cal_module
 from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
-from models import db, Event, Venue, Conversation, CustomTheme, VENUES, THEMES
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from models import db, Event, Venue, CustomTheme, VENUES, THEMES
 from routes.auth import login_required, editor_required
+from services import trigram
 from services.activity import log_activity
 from services.notifications import notify_event_created, notify_event_updated, notify_event_deleted
+from services.event_mentions import queue_reindex, mention_summary
+from services.export import csv_response, stream_query
 
 events_bp = Blueprint("events", __name__)
 
@@ -22,13 +23,7 @@ def index():
     query = Event.query
 
     if search:
-        query = query.filter(
-            db.or_(
-                Event.name.ilike(f"%{search}%"),
-                Event.venue.ilike(f"%{search}%"),
-                Event.description.ilike(f"%{search}%"),
-            )
-        )
+        query = query.filter(trigram.contains(search, Event.name, Event.venue, Event.description))
 
     if venue_filter:
         query = query.filter_by(venue=venue_filter)
@@ -83,6 +78,8 @@ def create():
             active=request.form.get("active") == "on",
         )
         db.session.add(event)
+        db.session.flush()
+        queue_reindex(event.id)
         log_activity("create", "event", details=f"Created event: {event.name}")
         notify_event_created(event.name, event.venue)
         db.session.commit()
@@ -98,6 +95,7 @@ def create():
 @editor_required
 def update(event_id):
     event = Event.query.get_or_404(event_id)
+    old_name = event.name
     try:
         event.name = request.form.get("name", event.name).strip()
         event.date = datetime.fromisoformat(request.form.get("date", event.date.isoformat()))
@@ -112,6 +110,8 @@ def update(event_id):
         event.active = request.form.get("active") == "on"
         log_activity("update", "event", event.id, f"Updated event: {event.name}")
         notify_event_updated(event.name)
+        if event.name != old_name:
+            queue_reindex(event.id)
         db.session.commit()
         flash("Fiesta actualizada correctamente", "success")
     except Exception as e:
@@ -129,6 +129,7 @@ def delete(event_id):
         log_activity("delete", "event", event_id, f"Deleted event: {event.name}")
         notify_event_deleted(event.name)
         db.session.delete(event)
+        queue_reindex(event_id)
         db.session.commit()
         flash("Fiesta eliminada", "success")
     except Exception as e:
@@ -155,14 +156,9 @@ def toggle(event_id):
 @events_bp.route("/events/export/csv")
 @login_required
 def export_csv():
-    events = Event.query.order_by(Event.date.desc()).all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Nombre", "Fecha", "Sala", "Tematica", "Aforo", "Precio", "Estado", "Creado"])
-
-    for e in events:
-        writer.writerow([
+    events = stream_query(Event.query.order_by(Event.date.desc()))
+    rows = (
+        [
             e.name,
             e.date.strftime("%Y-%m-%d %H:%M") if e.date else "",
             e.venue,
@@ -171,13 +167,13 @@ def export_csv():
             e.entry_price,
             "Activa" if e.active else "Inactiva",
             e.created_at.strftime("%Y-%m-%d") if e.created_at else "",
-        ])
-
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype="text/csv",
-        headers={"Content-Disposition": "attachment; filename=fiestas_export.csv"},
+        ]
+        for e in events
+    )
+    return csv_response(
+        "fiestas_export.csv",
+        ["Nombre", "Fecha", "Sala", "Tematica", "Aforo", "Precio", "Estado", "Creado"],
+        rows,
     )
 
 
@@ -246,25 +242,9 @@ def calendario():
 def analytics(event_id):
     event = Event.query.get_or_404(event_id)
 
-    mentions = (
-        Conversation.query
-        .filter(
-            Conversation.role == "user",
-            Conversation.content.ilike(f"%{event.name}%"),
-        )
-        .order_by(Conversation.created_at.asc())
-        .all()
-    )
-
-    mention_count = len(mentions)
-    unique_users = len(set(m.user_id for m in mentions))
-
-    daily_mentions = {}
-    for m in mentions:
-        day_key = m.created_at.strftime("%Y-%m-%d") if m.created_at else "unknown"
-        daily_mentions[day_key] = daily_mentions.get(day_key, 0) + 1
-
-    timeline = [{"date": k, "count": v} for k, v in sorted(daily_mentions.items())]
+    # Indexed aggregates over event_mentions (+ not-yet-indexed tail)
+    mention_count, unique_users, daily, stale = mention_summary(event)
+    timeline = [{"date": k, "count": v} for k, v in daily]
 
     return jsonify({
         "event_id": event.id,
@@ -272,6 +252,7 @@ def analytics(event_id):
         "mention_count": mention_count,
         "unique_users": unique_users,
         "timeline": timeline,
+        "stale": stale,
     })
 
 
@@ -1,206 +1,133 @@
-import csv
-import io
-from datetime import datetime, timedelta, timezone
-from flask import Blueprint, render_template, jsonify, Response
-from sqlalchemy import or_
-from models import db, Conversation, Event
-from routes.auth import login_required
-from services.cache import cached as _cached
-
-RRPP_KEYWORDS = [
-    'rrpp', 'promotor', 'promotora', 'comision', 'comisiones',
-    'ganar dinero', 'equipo', 'reclutar', 'relaciones publicas',
-    'codigo', 'enlace', 'rangos', 'puntos', 'ser rrpp',
-    'quiero ser', 'trabajar', 'sueldo', 'beneficios'
-]
+from datetime import timedelta
+from flask import Blueprint, render_template, jsonify
+from models import db, Event
+from routes import widgets
+from routes.auth import login_required, admin_required
+from services.cache import cached as _cached, stats as _cache_stats
+from services.export import csv_response, stream_query
+from services import rollups, cohorts, fanout, event_mentions as _mentions
 
 stats_bp = Blueprint("stats", __name__)
 _TTL = 180  # 3-minute cache for all heavy stats
+_STALE_TTL = 900  # serve up to 15 more minutes while refreshing in background
+_AI_STALE_TTL = 6 * 3600  # AI insights: never block a page on an OpenAI round trip
+COHORT_WEEKS = 12  # rows/columns of the cohort retention matrix
 
 
-@stats_bp.route("/estadisticas")
-@login_required
-def index():
-    now = datetime.now(timezone.utc)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+# ── Widgets (routes.widgets) ─────────────────────────────────
+
+def _kpis():
+    now, today_start = widgets.bounds()
     month_start = today_start.replace(day=1)
     prev_month_start = (month_start - timedelta(days=1)).replace(day=1)
-    eight_weeks_ago = today_start - timedelta(weeks=8)
-
-    def _compute():
-        # ── KPIs — 1 query ────────────────────────────────────────
-        row = db.session.query(
-            db.func.count(db.func.distinct(Conversation.user_id)).filter(
-                Conversation.created_at >= month_start),
-            db.func.count(db.func.distinct(Conversation.user_id)).filter(
-                Conversation.created_at >= prev_month_start,
-                Conversation.created_at < month_start),
-            db.func.count(db.func.distinct(Conversation.user_id)),
-            db.func.count(Conversation.id),
-        ).filter(Conversation.role == "user").one()
-        users_this_month, users_prev_month, total_users, total_messages = row
-
-        avg_per_user = round(total_messages / total_users, 1) if total_users else 0
-        if users_prev_month > 0:
-            user_growth = round(((users_this_month - users_prev_month) / users_prev_month) * 100)
-        else:
-            user_growth = 100 if users_this_month > 0 else 0
-
-        # ── Peak hour — 1 query ───────────────────────────────────
-        peak_row = (
-            db.session.query(
-                db.extract("hour", Conversation.created_at).label("h"),
-                db.func.count(Conversation.id).label("c"),
-            )
-            .filter(Conversation.role == "user")
-            .group_by("h").order_by(db.text("c DESC")).first()
-        )
-        peak_hour = f"{int(peak_row[0]):02d}:00" if peak_row else "--:--"
-
-        # ── Events — 1 query ──────────────────────────────────────
-        total_events = Event.query.count()
-        upcoming_events = Event.query.filter(Event.active == True, Event.date >= now).count()
-
-        # ── Retention — 1 subquery ───────────────────────────────
-        returning_users = (
-            db.session.query(db.func.count())
-            .select_from(
-                db.session.query(Conversation.user_id)
-                .filter(Conversation.role == "user")
-                .group_by(Conversation.user_id)
-                .having(db.func.count(Conversation.id) > 1)
-                .subquery()
-            )
-        ).scalar() or 0
-        retention_rate = round((returning_users / total_users) * 100, 1) if total_users else 0
-
-        # ── RRPP — 1 query (15 ILIKE, expensive) ─────────────────
-        keyword_filters = [Conversation.content.ilike(f'%{kw}%') for kw in RRPP_KEYWORDS]
-        rrpp_users = (
-            db.session.query(db.func.count(db.func.distinct(Conversation.user_id)))
-            .filter(Conversation.role == "user", or_(*keyword_filters))
-            .scalar()
-        ) or 0
-        rrpp_interest_rate = round((rrpp_users / total_users) * 100, 1) if total_users else 0
+    r = fanout.run({
+        # KPIs — rollups (user-days / users), not the message table
+        "this_month": lambda: rollups.distinct_users(month_start),
+        "prev_month": lambda: rollups.distinct_users(prev_month_start, month_start),
+        "total_users": rollups.distinct_users,
+        "total_messages": lambda: rollups.message_totals(today_start, today_start, month_start)[3],
+        # Peak hour — hourly rollup
+        "hourly": rollups.hourly_counts,
+        "total_events": lambda: Event.query.count(),
+        "upcoming_events": lambda: Event.query.filter(Event.active == True, Event.date >= now).count(),
+    })
+    users_this_month, users_prev_month = r["this_month"], r["prev_month"]
+    total_users, total_messages = r["total_users"], r["total_messages"]
+
+    avg_per_user = round(total_messages / total_users, 1) if total_users else 0
+    if users_prev_month > 0:
+        user_growth = round(((users_this_month - users_prev_month) / users_prev_month) * 100)
+    else:
+        user_growth = 100 if users_this_month > 0 else 0
+
+    hourly_map = r["hourly"]
+    peak_hour = f"{max(hourly_map, key=hourly_map.get):02d}:00" if hourly_map else "--:--"
+
+    return dict(
+        users_this_month=users_this_month, user_growth=user_growth,
+        total_users=total_users, avg_per_user=avg_per_user,
+        peak_hour=peak_hour, total_events=r["total_events"],
+        upcoming_events=r["upcoming_events"], total_messages=total_messages,
+    )
 
-        # ── Weekly users (8 weeks) — 1 query ─────────────────────
-        weekly_users_rows = (
-            db.session.query(
-                db.func.date(Conversation.created_at).label("day"),
-                Conversation.user_id,
-            )
-            .filter(Conversation.role == "user", Conversation.created_at >= eight_weeks_ago)
-            .distinct().all()
-        )
-        weekly_map: dict = {}
-        for r in weekly_users_rows:
-            d = r[0] if isinstance(r[0], datetime) else datetime.strptime(str(r[0]), "%Y-%m-%d")
-            week_key = d.strftime("%Y-W%W")
-            weekly_map.setdefault(week_key, set()).add(r[1])
 
-        # ── First-seen per user — 1 query ────────────────────────
-        first_seen_rows = (
-            db.session.query(
-                Conversation.user_id,
-                db.func.min(db.func.date(Conversation.created_at)).label("first_seen"),
-            )
-            .filter(Conversation.role == "user")
-            .group_by(Conversation.user_id).all()
-        )
-        first_seen_map = {r[0]: str(r[1]) for r in first_seen_rows}
+def _cohorts():
+    # Week bucketing + first-seen classification run in SQL (services.cohorts)
+    weeks = cohorts.new_vs_returning(8)
+    return {
+        "weekly_users": [{"week": w["week"], "count": w["users"]} for w in weeks],
+        "new_returning_weekly": [
+            {"week": w["week"], "new": w["new"], "returning": w["returning"]} for w in weeks
+        ],
+    }
 
-        weekly_users = []
-        new_returning_weekly = []
-        for i in range(8):
-            d = eight_weeks_ago + timedelta(weeks=i)
-            key = d.strftime("%Y-W%W")
-            label = d.strftime("%d/%m")
-            users_in_week = weekly_map.get(key, set())
-            weekly_users.append({"week": label, "count": len(users_in_week)})
-            w_start = d.strftime("%Y-%m-%d")
-            w_end = (d + timedelta(weeks=1)).strftime("%Y-%m-%d")
-            new_count = sum(
-                1 for uid in users_in_week
-                if first_seen_map.get(uid, "") >= w_start
-                and first_seen_map.get(uid, "") < w_end
-            )
-            new_returning_weekly.append({
-                "week": label, "new": new_count,
-                "returning": len(users_in_week) - new_count,
-            })
 
-        # ── Hourly activity — 1 query ─────────────────────────────
-        hourly_rows = (
-            db.session.query(
-                db.extract("hour", Conversation.created_at).label("h"),
-                db.func.count(Conversation.id),
-            )
-            .filter(Conversation.role == "user").group_by("h").all()
-        )
-        hourly_map = {int(r[0]): r[1] for r in hourly_rows}
-        hourly_messages = [{"hour": f"{h:02d}:00", "count": hourly_map.get(h, 0)} for h in range(24)]
+def _cohort_matrix():
+    return {"cohorts": cohorts.retention_matrix(COHORT_WEEKS)}
 
-        # ── Venues & themes — 2 queries ───────────────────────────
-        venue_rows = (
-            db.session.query(Event.venue, db.func.count(Event.id))
-            .group_by(Event.venue).order_by(db.func.count(Event.id).desc()).all()
-        )
-        venues_data = [{"venue": r[0], "count": r[1]} for r in venue_rows]
 
-        theme_rows = (
-            db.session.query(Event.theme, db.func.count(Event.id))
-            .group_by(Event.theme).order_by(db.func.count(Event.id).desc()).all()
-        )
-        themes_data = [{"theme": r[0], "count": r[1]} for r in theme_rows]
+def _events():
+    now, _ = widgets.bounds()
 
-        # ── Top users — 1 query ───────────────────────────────────
-        top_users = (
-            db.session.query(
-                Conversation.user_id,
-                db.func.count(Conversation.id).label("msg_count"),
-                db.func.count(db.func.distinct(db.func.date(Conversation.created_at))).label("days_active"),
-            )
-            .filter(Conversation.role == "user")
-            .group_by(Conversation.user_id)
-            .order_by(db.text("msg_count DESC")).limit(10).all()
-        )
-        top_users_data = [{"name": u[0], "messages": u[1], "days": u[2]} for u in top_users]
+    # ── Venues & themes — 2 queries ───────────────────────────
+    venue_rows = (
+        db.session.query(Event.venue, db.func.count(Event.id))
+        .group_by(Event.venue).order_by(db.func.count(Event.id).desc()).all()
+    )
+    theme_rows = (
+        db.session.query(Event.theme, db.func.count(Event.id))
+        .group_by(Event.theme).order_by(db.func.count(Event.id).desc()).all()
+    )
 
-        # ── Next events + mentions — 1 + 1 batch query ───────────
-        next_events = (
-            Event.query.filter(Event.active == True, Event.date >= now)
-            .order_by(Event.date.asc()).limit(5).all()
-        )
-        # Batch event mentions in ONE query instead of N
-        event_names = [e.name for e in next_events if e.name]
-        event_mentions = []
-        if event_names:
-            for name in event_names:
-                cnt = (
-                    Conversation.query
-                    .filter(Conversation.role == "user",
-                            Conversation.content.ilike(f'%{name}%'))
-                    .count()
-                )
-                event_mentions.append({"name": name, "mentions": cnt})
-            event_mentions.sort(key=lambda x: x["mentions"], reverse=True)
+    # ── Next events + mentions — 1 + 1 grouped query on the index
+    upcoming = (
+        Event.query.filter(Event.active == True, Event.date >= now)
+        .order_by(Event.date.asc()).limit(5).all()
+    )
+    mention_counts, mentions_stale = _mentions.mention_counts([e for e in upcoming if e.name])
+    event_mentions = sorted(
+        ({"name": e.name, "mentions": mention_counts[e.id]} for e in upcoming if e.name),
+        key=lambda x: x["mentions"], reverse=True,
+    )
+    return {
+        "venues_data": [{"venue": r[0], "count": r[1]} for r in venue_rows],
+        "themes_data": [{"theme": r[0], "count": r[1]} for r in theme_rows],
+        "event_mentions": event_mentions,
+        "event_mentions_stale": mentions_stale,
+        "next_events": [
+            {"name": e.name, "venue": e.venue, "theme": e.theme,
+             "day": e.date.strftime("%d"), "month": e.date.strftime("%b")}
+            for e in upcoming
+        ],
+    }
+
+
+def _top_users():
+    summary = rollups.users()
+    top_users = db.session.execute(
+        db.select(summary.c.user_id, summary.c.msg_count, summary.c.days_active)
+        .order_by(summary.c.msg_count.desc(), summary.c.user_id).limit(10)
+    ).all()
+    return {"top_users_data": [{"name": u[0], "messages": u[1], "days": u[2]} for u in top_users]}
+
+
+WIDGETS = {
+    "kpis": widgets.Widget(_kpis, 60, 300, 30, ("conversations", "events")),
+    "retention": widgets.Widget(rollups.funnel, _TTL, _STALE_TTL, 120, ("conversations",)),
+    "hourly": widgets.Widget(widgets.hourly, 300, _STALE_TTL, 120, ("conversations",)),
+    "cohorts": widgets.Widget(_cohorts, 600, 3600, 300, ("conversations",)),
+    "cohort_matrix": widgets.Widget(_cohort_matrix, 1800, 6 * 3600, 600, ("conversations",)),
+    "events": widgets.Widget(_events, _TTL, _STALE_TTL, 60, ("conversations", "events")),
+    "top_users": widgets.Widget(_top_users, 600, 3600, 300, ("conversations",)),
+}
+widgets.add_routes(stats_bp, "/estadisticas", WIDGETS)
 
-        return dict(
-            users_this_month=users_this_month, user_growth=user_growth,
-            total_users=total_users, avg_per_user=avg_per_user,
-            peak_hour=peak_hour, total_events=total_events,
-            upcoming_events=upcoming_events, total_messages=total_messages,
-            retention_rate=retention_rate, returning_users=returning_users,
-            rrpp_interest_rate=rrpp_interest_rate, rrpp_users=rrpp_users,
-            weekly_users=weekly_users, hourly_messages=hourly_messages,
-            venues_data=venues_data, themes_data=themes_data,
-            new_returning_weekly=new_returning_weekly,
-            event_mentions=event_mentions, top_users_data=top_users_data,
-            next_events=next_events,
-        )
 
-    data = _cached("stats_index", _compute, ttl=_TTL)
-    return render_template("estadisticas.html", **data)
+@stats_bp.route("/estadisticas")
+@login_required
+def index():
+    # Shell only: every figure is loaded from /estadisticas/data/<widget>
+    return render_template("estadisticas.html")
 
 
 @stats_bp.route("/estadisticas/insights")
@@ -208,7 +135,7 @@ def index():
 def insights():
     try:
         from services.ai_insights import get_insights
-        return jsonify(_cached("ai_insights", get_insights, ttl=3600))
+        return jsonify(_cached("ai_insights", get_insights, ttl=3600, stale_ttl=_AI_STALE_TTL))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -218,7 +145,7 @@ def insights():
 def rrpp_insights():
     try:
         from services.ai_insights import get_rrpp_insights
-        return jsonify(_cached("ai_rrpp_insights", get_rrpp_insights, ttl=3600))
+        return jsonify(_cached("ai_rrpp_insights", get_rrpp_insights, ttl=3600, stale_ttl=_AI_STALE_TTL))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -228,38 +155,38 @@ def rrpp_insights():
 def topic_distribution():
     try:
         from services.ai_insights import get_topic_distribution
-        return jsonify(_cached("ai_topic_dist", get_topic_distribution, ttl=3600))
+        return jsonify(_cached("ai_topic_dist", get_topic_distribution, ttl=3600, stale_ttl=_AI_STALE_TTL))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@stats_bp.route("/estadisticas/cache")
+@admin_required
+def cache_stats():
+    """Cache occupancy and counters (hits, evictions, coalesced stampedes)."""
+    return jsonify(_cache_stats())
+
+
 @stats_bp.route("/estadisticas/export/csv")
 @login_required
 def export_csv():
-    users_data = (
-        db.session.query(
-            Conversation.user_id,
-            db.func.count(Conversation.id).label("msg_count"),
-            db.func.min(Conversation.created_at).label("first_seen"),
-            db.func.max(Conversation.created_at).label("last_seen"),
-            db.func.count(db.func.distinct(db.func.date(Conversation.created_at))).label("days_active"),
-        )
-        .filter(Conversation.role == "user")
-        .group_by(Conversation.user_id)
-        .order_by(db.text("msg_count DESC")).all()
+    summary = rollups.users()
+    users_data = stream_query(
+        db.select(summary.c.user_id, summary.c.msg_count, summary.c.first_seen,
+                  summary.c.last_seen, summary.c.days_active)
+        .order_by(summary.c.msg_count.desc(), summary.c.user_id)
     )
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["User ID", "Mensajes", "Primera Vez", "Ultimo Mensaje", "Dias Activo"])
-    for u in users_data:
-        writer.writerow([
+    rows = (
+        [
             u.user_id, u.msg_count,
             u.first_seen.strftime("%Y-%m-%d %H:%M") if u.first_seen else "",
             u.last_seen.strftime("%Y-%m-%d %H:%M") if u.last_seen else "",
             u.days_active,
-        ])
-    output.seek(0)
-    return Response(
-        output.getvalue(), mimetype="text/csv",
-        headers={"Content-Disposition": "attachment; filename=estadisticas_usuarios_export.csv"},
+        ]
+        for u in users_data
+    )
+    return csv_response(
+        "estadisticas_usuarios_export.csv",
+        ["User ID", "Mensajes", "Primera Vez", "Ultimo Mensaje", "Dias Activo"],
+        rows,
     )
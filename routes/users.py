@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, g
 from models import db, User, ROLES
 from routes.auth import admin_required
+from services import trigram
 from services.activity import log_activity
 
 users_bp = Blueprint("users", __name__)
@@ -15,12 +16,7 @@ def index():
     query = User.query
 
     if search:
-        query = query.filter(
-            db.or_(
-                User.email.ilike(f"%{search}%"),
-                User.name.ilike(f"%{search}%"),
-            )
-        )
+        query = query.filter(trigram.contains(search, User.email, User.name))
 
     if role_filter and role_filter in ROLES:
         query = query.filter_by(role=role_filter)
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from models import db, Venue
 from routes.auth import admin_required
+from services import trigram
 from services.activity import log_activity
 
 venues_bp = Blueprint("venues", __name__)
@@ -14,12 +15,7 @@ def index():
 
     query = Venue.query
     if search:
-        query = query.filter(
-            db.or_(
-                Venue.name.ilike(f"%{search}%"),
-                Venue.address.ilike(f"%{search}%"),
-            )
-        )
+        query = query.filter(trigram.contains(search, Venue.name, Venue.address))
     if status == "active":
         query = query.filter_by(active=True)
     elif status == "inactive":
@@ -0,0 +1,47 @@
+"""
+Widget endpoints shared by the dashboard and the stats page.
+
+Both pages are shells that load every figure from <prefix>/data/<widget>;
+each widget is one JSON endpoint with its own cache policy. A blueprint
+declares its WIDGETS and calls add_routes.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+from flask import abort
+from routes.auth import login_required
+from services.cache import cached
+from services.http_cache import json_etag
+from services import incremental, rollups
+
+# (compute, server ttl, stale_ttl, browser max-age, tables it depends on)
+Widget = namedtuple("Widget", "compute ttl stale_ttl max_age depends_on")
+
+
+def bounds():
+    """(now, start of today), aware UTC."""
+    now = datetime.now(timezone.utc)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return now, today_start
+
+
+def hourly():
+    # Hourly messages chart — rollup rows grouped by hour
+    hourly_map = rollups.hourly_counts()
+    return {"hourly_messages": [{"hour": f"{h:02d}:00", "count": hourly_map.get(h, 0)} for h in range(24)]}
+
+
+def add_routes(bp, prefix, widgets):
+    """Serve {name: Widget} at <prefix>/data/<name> (endpoint "<bp>.widget")."""
+
+    @login_required
+    def widget(name):
+        w = widgets.get(name)
+        if w is None:
+            abort(404)
+        # Fold new bot conversations into the rollup tables (throttled, bounded)
+        incremental.catch_up()
+        data = cached(f"{bp.name}:{name}", w.compute, ttl=w.ttl, stale_ttl=w.stale_ttl,
+                      depends_on=w.depends_on)
+        return json_etag(data, max_age=w.max_age)
+
+    bp.add_url_rule(f"{prefix}/data/<name>", "widget", widget)
@@ -0,0 +1,95 @@
+"""
+Benchmark the /clientes search filter: ILIKE scan vs trigram index.
+
+    python scripts/bench_trigram.py [--clients 100000] [--url postgresql://...]
+
+Seeds N synthetic clients into a throwaway database (a temp SQLite file by
+default; pass --url only for a scratch Postgres database, the clients table
+is filled with fake rows) and prints the median latency of the same searches
+through plain ILIKE and through services.trigram.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIRST = ["Lucía", "Pablo", "Elena", "Marcos", "Sara", "Alejandro", "Marta", "Hugo", "Carmen", "Iván"]
+LAST = ["García", "Ruiz", "López", "Jiménez", "Moreno", "Navarro", "Torres", "Díaz", "Romero", "Vega"]
+QUERIES = ["garcía", "ruiz", "655 12", "tg_5039", "ivan", "zzzz"]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--clients", type=int, default=100_000)
+    p.add_argument("--runs", type=int, default=15)
+    p.add_argument("--url", help="database URL (default: a temp SQLite file)")
+    return p.parse_args()
+
+
+def seed(db, Client, n):
+    rnd = random.Random(42)
+    rows = [
+        {
+            "name": f"{rnd.choice(FIRST)} {rnd.choice(LAST)} {rnd.choice(LAST)}",
+            "phone": f"+34 6{rnd.randint(10, 99)} {rnd.randint(100, 999)} {rnd.randint(100, 999)}",
+            "chat_id": f"tg_{rnd.randint(10**8, 10**9 - 1)}_{i}",
+        }
+        for i in range(n)
+    ]
+    for i in range(0, n, 10_000):
+        db.session.execute(db.insert(Client), rows[i:i + 10_000])
+    db.session.commit()
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    args = parse_args()
+    tmp = None
+    if not args.url:
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        args.url = f"sqlite:///{tmp.name}"
+    os.environ["DATABASE_URL"] = args.url
+
+    from app import app
+    from models import db, Client
+    from services import trigram
+
+    with app.app_context():
+        Client.query.delete()
+        db.session.commit()
+        t0 = time.perf_counter()
+        seed(db, Client, args.clients)
+        seeded = time.perf_counter() - t0
+        trigram.install(rebuild=True)
+        print(f"{db.engine.dialect.name}: {args.clients} clients seeded in {seeded:.1f}s")
+
+        cols = (Client.name, Client.phone, Client.chat_id)
+        print(f"{'query':<10} {'matches':>8} {'ILIKE ms':>10} {'trigram ms':>11}")
+        for q in QUERIES:
+            ilike = Client.query.filter(db.or_(*(c.ilike(f"%{q}%") for c in cols)))
+            indexed = Client.query.filter(trigram.contains(q, *cols))
+            matches = indexed.count()
+            a = timed(lambda: ilike.order_by(Client.name).limit(50).all(), args.runs)
+            b = timed(lambda: indexed.order_by(Client.name).limit(50).all(), args.runs)
+            print(f"{q:<10} {matches:>8} {a:>10.1f} {b:>11.1f}")
+
+    if tmp:
+        os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
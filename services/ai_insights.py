@@ -2,8 +2,8 @@ import json
 import os
 import time
 from openai import OpenAI
-from sqlalchemy import or_
 from models import db, Conversation
+from services import incremental, tagging
 
 # In-memory caches
 _cache = {"data": None, "expires": 0}
@@ -13,13 +13,6 @@ _topics_cache = {"data": None, "expires": 0}
 CACHE_TTL = 3600       # 1 hour
 RRPP_CACHE_TTL = 7200  # 2 hours
 
-RRPP_KEYWORDS = [
-    'rrpp', 'promotor', 'promotora', 'comision', 'comisiones',
-    'ganar dinero', 'equipo', 'reclutar', 'relaciones publicas',
-    'codigo', 'enlace', 'rangos', 'puntos', 'ser rrpp',
-    'quiero ser', 'trabajar', 'sueldo', 'beneficios'
-]
-
 
 def _parse_json_response(raw):
     """Parse JSON from GPT response, handling markdown code blocks."""
@@ -145,11 +138,9 @@ def _generate_rrpp_insights():
             "nivel_interes", "sugerencias_conversion"
         ]}
 
-    keyword_filters = [Conversation.content.ilike(f'%{kw}%') for kw in RRPP_KEYWORDS]
+    incremental.catch_up()
     messages = (
-        Conversation.query
-        .filter_by(role="user")
-        .filter(or_(*keyword_filters))
+        tagging.tagged_messages(tagging.TAG_RRPP)
         .order_by(Conversation.created_at.desc())
         .limit(150)
         .all()
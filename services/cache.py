@@ -1,32 +1,488 @@
 """
-Simple thread-safe in-memory TTL cache.
+Thread-safe LRU cache with per-entry TTL and pluggable storage.
 Works for warm server processes (local + Vercel warm lambdas).
+
+Storage backends:
+ - MemoryBackend (default): per-process dict, bounded by entry count and
+   approximate size in bytes, least recently used entries evicted first.
+ - SQLiteBackend (CACHE_BACKEND=sqlite): pickled values in a WAL-mode SQLite
+   file shared by every worker process on the host. Unpickling runs code, so
+   the file lives in a directory only this user can write (0700, the file
+   0600) and the backend refuses a file or directory owned by anyone else.
+
+A daemon thread sweeps expired entries. Concurrent misses on the same key are
+coalesced: one caller computes, the rest wait for its result (single-flight,
+per process). Entries cached with stale_ttl are served past their TTL for that
+extra window while a background thread recomputes them
+(stale-while-revalidate). Entries can declare the tables they depend on
+(depends_on=...); invalidate_tables() drops them, and services.invalidation
+calls it after every commit that wrote to those tables.
 """
+import os
+import pickle
+import sqlite3
+import stat
+import sys
+import tempfile
 import threading
-from datetime import datetime
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+
+BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory | sqlite
+SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH") or os.path.join(
+    tempfile.gettempdir(), f"madness-cache-{os.getuid()}", "cache.sqlite"
+)
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))  # 32 MB
+SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", "60"))  # seconds
+WAIT_TIMEOUT = float(os.getenv("CACHE_WAIT_TIMEOUT", "30"))  # seconds a waiter blocks on a leader
 
-_store: dict = {}
 _lock = threading.Lock()
+_counters = {
+    "hits": 0, "misses": 0, "expirations": 0,
+    "coalesced": 0, "wait_timeouts": 0, "stale_served": 0, "refresh_errors": 0,
+    "invalidations": 0,
+}
+_inflight: dict = {}
+_table_gen: dict = {}  # table -> bumped on every invalidate_tables()
+_sweeper = None
+
+
+def _sizeof(obj, _seen=None, _depth=0):
+    """Rough recursive size of obj in bytes (containers + ORM __dict__)."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen or _depth > 6:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj, 64)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _sizeof(k, _seen, _depth + 1) + _sizeof(v, _seen, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += _sizeof(item, _seen, _depth + 1)
+    elif hasattr(obj, "__dict__"):
+        size += _sizeof(vars(obj), _seen, _depth + 1)
+    return size
+
+
+# ── Backends ──────────────────────────────────────────────
+# Entries are dicts: {"val", "fresh_until", "expires", "tags"}. Backends only
+# store them; expiry decisions are made by the functions at the bottom of this
+# file. "tags" is a tuple of table names the value was computed from.
+
+class MemoryBackend:
+    """Per-process LRU store bounded by entry count and approximate bytes."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._store: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._evictions = 0
+
+    def _drop(self, key):
+        entry = self._store.pop(key, None)
+        if entry:
+            self._size -= entry["size"]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._store.get(key)
+            if entry:
+                self._store.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = _sizeof(entry["val"])
+        with self._lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                return  # would evict everything else; don't cache it at all
+            self._store[key] = dict(entry, size=size)
+            self._size += size
+            while self._store and (len(self._store) > self.max_entries or self._size > self.max_bytes):
+                self._drop(next(iter(self._store)))
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._drop(key)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            if not prefix:
+                self._store.clear()
+                self._size = 0
+                return
+            for k in [k for k in self._store if k.startswith(prefix)]:
+                self._drop(k)
+
+    def delete_tagged(self, tags):
+        with self._lock:
+            dead = [k for k, e in self._store.items() if tags.intersection(e.get("tags", ()))]
+            for k in dead:
+                self._drop(k)
+            return len(dead)
+
+    def sweep(self, now):
+        with self._lock:
+            dead = [k for k, e in self._store.items() if e["expires"] <= now]
+            for k in dead:
+                self._drop(k)
+            return len(dead)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._store), "bytes": self._size,
+                    "evictions": self._evictions,
+                    "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+
+def _check_private(path, kind):
+    """Raise PermissionError unless `path` is ours and closed to other users."""
+    st = os.lstat(path)
+    expected = stat.S_ISDIR if kind == "directory" else stat.S_ISREG
+    if not expected(st.st_mode):
+        raise PermissionError(f"cache {kind} {path} is not a plain {kind}")
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"cache {kind} {path} is owned by uid {st.st_uid}")
+    if st.st_mode & 0o077:
+        raise PermissionError(f"cache {kind} {path} is accessible to other users")
+
+
+def _private_file(path):
+    """Create the cache file's directory (0700) and the file (0600) if missing,
+    then check both, so nobody else can plant pickles for us to load."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    _check_private(directory, "directory")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    os.close(fd)
+    _check_private(path, "file")
+
+
+class SQLiteBackend:
+    """Host-wide store: pickled entries in a WAL-mode SQLite file.
+
+    Every worker process (gunicorn workers, warm lambdas sharing /tmp) opens
+    the same file, so a value computed by one worker is reused by the rest.
+    LRU order is approximated by an `accessed` timestamp.
+    """
+
+    _TOUCH_EVERY = 5  # seconds between LRU timestamp writes for a hot key
+
+    def __init__(self, path=SQLITE_PATH, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._evictions = 0
+        _private_file(path)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY, val BLOB NOT NULL, size INTEGER NOT NULL,"
+            " fresh_until REAL NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL,"
+            " tags TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {r[1] for r in conn.execute("PRAGMA table_info(cache_entries)")}
+        if "tags" not in columns:  # file created before dependency tags existed
+            conn.execute("ALTER TABLE cache_entries ADD COLUMN tags TEXT NOT NULL DEFAULT ''")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_expires ON cache_entries (expires)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (accessed)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT val, fresh_until, expires, accessed, tags FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        now = time.time()
+        if now - row[3] > self._TOUCH_EVERY:
+            self._conn().execute("UPDATE cache_entries SET accessed = ? WHERE key = ?", (now, key))
+        return {"val": pickle.loads(row[0]), "fresh_until": row[1], "expires": row[2],
+                "tags": tuple(t for t in row[4].split(",") if t)}
+
+    def set(self, key, entry):
+        blob = pickle.dumps(entry["val"], pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, val, size, fresh_until, expires, accessed, tags)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, blob, len(blob), entry["fresh_until"], entry["expires"], time.time(),
+             "," + ",".join(entry.get("tags", ())) + ","),
+        )
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+        while count > self.max_entries or size > self.max_bytes:
+            victim = conn.execute(
+                "SELECT key, size FROM cache_entries ORDER BY accessed ASC LIMIT 1"
+            ).fetchone()
+            if not victim:
+                break
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (victim[0],))
+            count, size = count - 1, size - victim[1]
+            self._evictions += 1
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        if not prefix:
+            self._conn().execute("DELETE FROM cache_entries")
+        else:
+            self._conn().execute(
+                "DELETE FROM cache_entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            )
+
+    def delete_tagged(self, tags):
+        # tags column holds comma-wrapped table names, e.g. ",events,conversations,"
+        removed = 0
+        for tag in tags:
+            removed += self._conn().execute(
+                "DELETE FROM cache_entries WHERE instr(tags, ?) > 0", (f",{tag},",)
+            ).rowcount
+        return removed
+
+    def sweep(self, now):
+        return self._conn().execute("DELETE FROM cache_entries WHERE expires <= ?", (now,)).rowcount
+
+    def stats(self):
+        count, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        return {"backend": "sqlite", "path": self.path, "entries": count, "bytes": size,
+                "evictions": self._evictions,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+
+def _make_backend():
+    if BACKEND == "sqlite":
+        try:
+            return SQLiteBackend()
+        except (sqlite3.Error, OSError) as e:
+            print(f"[WARNING] Shared cache unavailable ({e}), using in-memory cache")
+    return MemoryBackend()
+
+
+_backend = _make_backend()
+
+
+def set_backend(backend):
+    """Swap the storage backend (drops nothing from the previous one)."""
+    global _backend
+    _backend = backend
+
 
+# ── Expiry sweeper ────────────────────────────────────────
 
-def cached(key: str, fn, ttl: int = 120):
-    """Return cached value if fresh, else run fn(), store and return result."""
+def _sweep():
+    """Drop every expired entry."""
+    removed = _backend.sweep(time.time())
     with _lock:
-        entry = _store.get(key)
-        if entry and (datetime.now().timestamp() - entry["ts"]) < ttl:
-            return entry["val"]
-    val = fn()
+        _counters["expirations"] += removed
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            _sweep()
+        except Exception as e:
+            print(f"[WARNING] Cache sweep failed: {e}")
+
+
+def _ensure_sweeper():
+    global _sweeper
+    if _sweeper is None or not _sweeper.is_alive():
+        _sweeper = threading.Thread(target=_sweep_loop, name="cache-sweeper", daemon=True)
+        _sweeper.start()
+
+
+# ── Public API ────────────────────────────────────────────
+
+class _Flight:
+    """A computation in progress for one key; waiters block on `done`."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.val = None
+        self.error = None
+
+
+def _lookup(key: str):
+    """Return ("fresh" | "stale" | None, value), touching LRU order on a hit."""
+    now = time.time()
+    try:
+        entry = _backend.get(key)
+    except Exception as e:
+        print(f"[WARNING] Cache read of '{key}' failed: {e}")
+        entry = None
+    with _lock:
+        if entry and entry["expires"] > now:
+            if entry["fresh_until"] > now:
+                _counters["hits"] += 1
+                return "fresh", entry["val"]
+            _counters["stale_served"] += 1
+            return "stale", entry["val"]
+        if entry:
+            _counters["expirations"] += 1
+        _counters["misses"] += 1
+    if entry:
+        _backend.delete(key)
+    return None, None
+
+
+def get(key: str):
+    """Return (hit, value) for key; stale entries count as a miss."""
+    state, val = _lookup(key)
+    return state == "fresh", val
+
+
+def put(key: str, val, ttl: int = 120, stale_ttl: int = 0, depends_on=()):
+    """Store val fresh for ttl seconds (+ stale_ttl servable while refreshing)."""
+    now = time.time()
+    entry = {"val": val, "fresh_until": now + ttl, "expires": now + ttl + stale_ttl,
+             "tags": tuple(depends_on)}
+    try:
+        _backend.set(key, entry)
+    except Exception as e:
+        print(f"[WARNING] Cache write of '{key}' failed: {e}")
+        return
+    _ensure_sweeper()
+
+
+def _claim(key: str):
+    """Return (flight, is_leader) for key's in-flight computation."""
+    with _lock:
+        flight = _inflight.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _inflight[key] = _Flight()
+        return flight, True
+
+
+def _generations(tables):
+    with _lock:
+        return tuple(_table_gen.get(t, 0) for t in tables)
+
+
+def _lead(key, flight, fn, ttl, stale_ttl, depends_on=()):
+    """Run fn() as the single leader for key and publish the outcome."""
+    try:
+        gen = _generations(depends_on)
+        flight.val = fn()
+        # A commit touching our tables landed mid-computation: the value may
+        # already be stale, so hand it to this round of callers but don't store it.
+        if _generations(depends_on) == gen:
+            put(key, flight.val, ttl, stale_ttl, depends_on)
+        return flight.val
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+
+
+def _refresh_async(key, fn, ttl, stale_ttl, depends_on=()):
+    """Recompute key on a daemon thread unless a refresh is already running."""
+    flight, leader = _claim(key)
+    if not leader:
+        return
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def run():
+        try:
+            if app is None:
+                _lead(key, flight, fn, ttl, stale_ttl, depends_on)
+            else:
+                with app.app_context():
+                    _lead(key, flight, fn, ttl, stale_ttl, depends_on)
+        except Exception as e:
+            with _lock:
+                _counters["refresh_errors"] += 1
+            print(f"[WARNING] Background refresh of cache key '{key}' failed: {e}")
+
+    threading.Thread(target=run, name=f"cache-refresh:{key}", daemon=True).start()
+
+
+def cached(key: str, fn, ttl: int = 120, stale_ttl: int = 0, wait_timeout: float = None,
+           depends_on=()):
+    """Return cached value if fresh, else run fn(), store and return result.
+
+    Only one caller per key runs fn(); concurrent callers wait up to
+    wait_timeout seconds (default WAIT_TIMEOUT) for its result and re-raise
+    its exception if it fails. A waiter that times out computes on its own.
+
+    With stale_ttl > 0 a value older than ttl (soft expiry) but younger than
+    ttl + stale_ttl (hard expiry) is returned immediately and refreshed in
+    the background with the caller's app context.
+
+    depends_on names the tables fn() reads (e.g. ("events", "conversations"));
+    a commit writing any of them drops the entry via invalidate_tables().
+    """
+    state, val = _lookup(key)
+    if state == "fresh":
+        return val
+    if state == "stale":
+        _refresh_async(key, fn, ttl, stale_ttl, depends_on)
+        return val
+
+    flight, leader = _claim(key)
+    if leader:
+        return _lead(key, flight, fn, ttl, stale_ttl, depends_on)
+
+    timeout = WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+    if flight.done.wait(timeout):
+        with _lock:
+            _counters["coalesced"] += 1
+        if flight.error is not None:
+            raise flight.error
+        return flight.val
     with _lock:
-        _store[key] = {"val": val, "ts": datetime.now().timestamp()}
-    return val
+        _counters["wait_timeouts"] += 1
+    return fn()
 
 
 def invalidate(prefix: str = ""):
     """Invalidate all keys matching prefix (or all if empty)."""
+    _backend.delete_prefix(prefix)
+
+
+def invalidate_tables(tables):
+    """Drop every entry that declared a dependency on any of these tables."""
+    tables = set(tables)
+    if not tables:
+        return 0
     with _lock:
-        if not prefix:
-            _store.clear()
-        else:
-            for k in list(_store.keys()):
-                if k.startswith(prefix):
-                    del _store[k]
+        for t in tables:
+            _table_gen[t] = _table_gen.get(t, 0) + 1
+    removed = _backend.delete_tagged(tables)
+    with _lock:
+        _counters["invalidations"] += removed
+    return removed
+
+
+def stats() -> dict:
+    """Snapshot of cache occupancy and hit/miss/eviction/coalescing counters."""
+    with _lock:
+        counters = dict(_counters, inflight=len(_inflight))
+    return dict(counters, **_backend.stats())
@@ -0,0 +1,103 @@
+"""
+Weekly cohorts computed in the database.
+
+Weeks are rolling 7-day windows ending today. Every (day, user) pair from the
+conversation_user_daily rollup (plus the not-yet-rolled-up tail) is bucketed
+into a week, and every user into the week of their first message from
+conversation_users.first_seen; one GROUP BY (first week, active week) then
+returns at most N×(N+1) counts, from which both the new-vs-returning chart
+and the cohort retention matrix are derived.
+"""
+from datetime import datetime, timedelta, timezone
+from models import db, Conversation, ConversationUserDaily, ConversationUser
+from services import incremental, rollups
+
+BEFORE = -1  # first-week bucket of users first seen before the window
+
+
+def _window(weeks):
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    start = today + timedelta(days=1) - timedelta(weeks=weeks)
+    return [start + timedelta(weeks=i) for i in range(weeks + 1)]
+
+
+def _bucket(col, bounds, before=None):
+    """CASE mapping col to the index of its week in bounds (a sorted list)."""
+    whens = [] if before is None else [(col < bounds[0], before)]
+    whens += [(col < b, i) for i, b in enumerate(bounds[1:-1])]
+    return db.case(*whens, else_=len(bounds) - 2)
+
+
+def counts(weeks=8):
+    """({(first_week, week): users}, week starts) for the last `weeks` weeks.
+
+    first_week is BEFORE for users whose first message predates the window.
+    """
+    bounds = _window(weeks)
+    start = bounds[0]
+    D, U, C = ConversationUserDaily, ConversationUser, Conversation
+    tail = (C.role == "user", C.id > incremental.watermark_expr(rollups.JOB))
+
+    pairs = db.union(
+        db.select(D.day.label("day"), D.user_id.label("user_id")).where(D.day >= start.date()),
+        db.select(db.func.date(C.created_at).label("day"), C.user_id.label("user_id"))
+        .where(*tail, C.created_at >= start),
+    ).subquery()
+
+    in_window = db.select(pairs.c.user_id)
+    firsts = db.union_all(
+        db.select(U.user_id.label("user_id"), U.first_seen.label("first"))
+        .where(U.user_id.in_(in_window)),
+        db.select(C.user_id.label("user_id"), C.created_at.label("first"))
+        .where(*tail, C.user_id.in_(in_window)),
+    ).subquery()
+    first_seen = (
+        db.select(firsts.c.user_id, db.func.min(firsts.c.first).label("first"))
+        .group_by(firsts.c.user_id).subquery()
+    )
+
+    bucketed = (
+        db.select(
+            _bucket(first_seen.c.first, bounds, before=BEFORE).label("first_week"),
+            _bucket(pairs.c.day, [b.date() for b in bounds]).label("week"),
+            pairs.c.user_id,
+        )
+        .select_from(pairs.join(first_seen, first_seen.c.user_id == pairs.c.user_id))
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(bucketed.c.first_week, bucketed.c.week, db.func.count(db.distinct(bucketed.c.user_id)))
+        .group_by(bucketed.c.first_week, bucketed.c.week)
+    ).all()
+    return {(int(f), int(w)): n for f, w, n in rows}, bounds[:-1]
+
+
+def new_vs_returning(weeks=8):
+    """Per week: active users, how many were new that week, how many returning."""
+    grid, starts = counts(weeks)
+    out = []
+    for w, d in enumerate(starts):
+        active = sum(n for (f, wk), n in grid.items() if wk == w)
+        new = grid.get((w, w), 0)
+        out.append({"week": d.strftime("%d/%m"), "users": active, "new": new, "returning": active - new})
+    return out
+
+
+def retention_matrix(weeks=12):
+    """Cohort rows: week of first contact, cohort size, users active k weeks later.
+
+    `retention[k]` is the share (%) of the cohort active in week k after first
+    contact (k=0 is always 100); only weeks that have happened are listed.
+    """
+    grid, starts = counts(weeks)
+    rows = []
+    for c, d in enumerate(starts):
+        size = grid.get((c, c), 0)
+        active = [grid.get((c, c + k), 0) for k in range(weeks - c)]
+        rows.append({
+            "week": d.strftime("%d/%m"),
+            "size": size,
+            "active": active,
+            "retention": [round(n / size * 100, 1) if size else 0 for n in active],
+        })
+    return rows
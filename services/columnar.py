@@ -0,0 +1,236 @@
+"""
+Columnar export of conversations, clients and events for offline analysis.
+
+Each table is written under `<out_dir>/<table>/month=YYYY-MM/` (partitioned
+by `created_at`), so pandas / DuckDB / Spark can read a single month or the
+whole directory as one dataset. Runs are incremental: each file is named
+`part-<first id>-<last id>` and the highest id exported per format is kept in
+`<table>/.watermark.<format>`, so a run only adds files for rows appended
+since the previous one. Every part is first written to a temp name; they are
+moved into place together once all are complete, and the watermark is saved
+last, so an interrupted run leaves no partial file and its published parts
+are replaced by the next run. Rows younger than incremental.COMMIT_LAG wait
+for the next run (a lower id may still be committing). Rows edited after
+they were exported (clients, events) are not re-exported; `full=True`
+deletes the table's files in that format and rewrites everything.
+
+Needs pyarrow (optional, not in requirements.txt). Parquet is the default;
+`fmt="arrow"` writes Arrow IPC files instead.
+"""
+import os
+import re
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from models import db, Conversation, Client, Event
+from services import incremental
+from services.export import stream_query
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional dependency
+    pa = None
+
+TABLES = {
+    "conversations": Conversation,
+    "clients": Client,
+    "events": Event,
+}
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+BATCH_ROWS = 10000  # rows per record batch / row group
+
+
+def _part_re(fmt):
+    """Part files of one format; each format keeps its own high-water mark."""
+    return re.compile(r"^part-(\d+)-(\d+)" + re.escape(FORMATS[fmt]) + "$")
+
+
+def _require_pyarrow(fmt):
+    if pa is None:
+        raise RuntimeError("Columnar export needs pyarrow: pip install pyarrow")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (expected one of {', '.join(FORMATS)})")
+
+
+def _arrow_type(column):
+    t = column.type
+    if isinstance(t, sa.Boolean):
+        return pa.bool_()
+    if isinstance(t, sa.Integer):
+        return pa.int64()
+    if isinstance(t, sa.DateTime):
+        return pa.timestamp("us")
+    if isinstance(t, sa.Date):
+        return pa.date32()
+    if isinstance(t, sa.Float):
+        return pa.float64()
+    if isinstance(t, sa.LargeBinary):
+        return pa.binary()
+    return pa.string()
+
+
+def schema(model):
+    return pa.schema([(c.name, _arrow_type(c)) for c in model.__table__.columns])
+
+
+def _month(created_at):
+    return created_at.strftime("%Y-%m") if created_at else "unknown"
+
+
+class _Partition:
+    """Rows of one month, buffered and appended to a temp file in batches."""
+
+    def __init__(self, directory, schema, fmt):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.schema = schema
+        self.fmt = fmt
+        self.tmp = os.path.join(directory, f".part-{os.getpid()}.tmp")
+        self.writer = None
+        self.rows = []
+        self.first_id = self.last_id = None
+
+    def add(self, row, row_id):
+        self.rows.append(row)
+        if self.first_id is None:
+            self.first_id = row_id
+        self.last_id = row_id
+        if len(self.rows) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        batch = pa.RecordBatch.from_pylist(self.rows, schema=self.schema)
+        if self.writer is None:
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.tmp, self.schema, compression="zstd")
+            else:
+                self.writer = pa.ipc.new_file(self.tmp, self.schema)
+        self.writer.write_batch(batch)
+        self.rows = []
+
+    def finish(self):
+        """Complete the temp file (it isn't visible as a part yet)."""
+        self.flush()
+        self.writer.close()
+        self.writer = None
+
+    def publish(self):
+        """Move the finished file into place; returns its path."""
+        path = os.path.join(
+            self.directory,
+            f"part-{self.first_id:010d}-{self.last_id:010d}{FORMATS[self.fmt]}",
+        )
+        os.replace(self.tmp, path)
+        return path
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+def _parts(root, fmt):
+    """(path, first id, last id) of every `fmt` part file under `root`."""
+    pattern = _part_re(fmt)
+    for directory, _, files in os.walk(root):
+        for f in files:
+            m = pattern.match(f)
+            if m:
+                yield os.path.join(directory, f), int(m.group(1)), int(m.group(2))
+
+
+def _watermark_path(root, fmt):
+    return os.path.join(root, f".watermark{FORMATS[fmt]}")
+
+
+def watermark(root, fmt="parquet") -> int:
+    """Highest id exported under `root` in `fmt` by a run that completed (0 if none)."""
+    try:
+        with open(_watermark_path(root, fmt)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        # Directory written before the watermark file existed
+        return max((last for _, _, last in _parts(root, fmt)), default=0)
+
+
+def _save_watermark(root, fmt, last_id):
+    path = _watermark_path(root, fmt)
+    with open(path + ".tmp", "w") as f:
+        f.write(str(last_id))
+    os.replace(path + ".tmp", path)
+
+
+def _settled_id(model, last_id):
+    """Highest id that is safe to export: stop below the first row younger
+    than incremental.COMMIT_LAG, since a lower id may still be committing."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=incremental.COMMIT_LAG)
+    young = db.session.execute(
+        db.select(db.func.min(model.id)).where(model.id > last_id, model.created_at >= cutoff)
+    ).scalar()
+    return young - 1 if young is not None else None
+
+
+def export_table(table, out_dir, fmt="parquet", full=False) -> dict:
+    """Write rows of `table` added since the last run; returns a summary dict."""
+    _require_pyarrow(fmt)
+    model = TABLES[table]
+    root = os.path.join(out_dir, table)
+    if full:  # only this format's files; the other format keeps its own
+        for path, _, _ in list(_parts(root, fmt)):
+            os.remove(path)
+        if os.path.exists(_watermark_path(root, fmt)):
+            os.remove(_watermark_path(root, fmt))
+    last_id = watermark(root, fmt)
+    # Parts above the watermark come from a run that died before saving it
+    for path, first, _ in list(_parts(root, fmt)):
+        if first > last_id:
+            os.remove(path)
+
+    arrow_schema = schema(model)
+    columns = [c.name for c in model.__table__.columns]
+    query = (
+        db.select(*model.__table__.columns)
+        .where(model.id > last_id)
+        .order_by(model.id)
+    )
+    settled = _settled_id(model, last_id)
+    if settled is not None:
+        query = query.where(model.id <= settled)
+
+    partitions = {}
+    rows = 0
+    try:
+        for row in stream_query(query):
+            record = dict(zip(columns, row))
+            month = _month(record["created_at"])
+            part = partitions.get(month)
+            if part is None:
+                part = partitions[month] = _Partition(
+                    os.path.join(root, f"month={month}"), arrow_schema, fmt,
+                )
+            part.add(record, record["id"])
+            rows += 1
+        for part in partitions.values():
+            part.finish()
+    except Exception:
+        for part in partitions.values():
+            part.discard()
+        raise
+    # Every part is complete: publish them, then record the watermark. A crash
+    # in between leaves parts above the old watermark, removed by the next run.
+    try:
+        files = [part.publish() for part in partitions.values()]
+    except Exception:
+        for part in partitions.values():
+            part.discard()
+        raise
+    if partitions:
+        _save_watermark(root, fmt, max(part.last_id for part in partitions.values()))
+    return {"table": table, "rows": rows, "files": files}
+
+
+def export_all(out_dir, tables=None, fmt="parquet", full=False) -> list:
+    return [export_table(t, out_dir, fmt=fmt, full=full) for t in (tables or TABLES)]
@@ -0,0 +1,176 @@
+"""
+Event-mention index: which user messages mention which event by name.
+
+One accent-insensitive Aho-Corasick pass per conversation batch matches every
+event name at once (the "event_mentions" incremental job). Creating, renaming
+or deleting an event only drops its mentions and, if it still exists, queues
+it in event_mention_backfill with the save; the job then scans the history it
+had already processed for that event in BATCH_SIZE chunks (inline catch-ups
+spend their spare batches on it, `flask jobs run` finishes it). Later rows
+are matched with the new name as they arrive. Until the backfill is done the
+event's counts only cover the part scanned so far.
+"""
+from collections import Counter
+from models import db, Conversation, Event, EventMention, EventMentionBackfill
+from services import incremental
+from services.text_match import Matcher, normalize
+
+JOB = "event_mentions"
+
+
+def _event_matcher(events):
+    """Matcher labelling each normalized event name with the ids that use it."""
+    ids_by_name: dict = {}
+    for e in events:
+        if e.name and normalize(e.name).strip():
+            ids_by_name.setdefault(normalize(e.name), []).append(e.id)
+    return Matcher({name: name for name in ids_by_name}), ids_by_name
+
+
+def _mentions(rows, events):
+    """Yield (event_id, conversation row) for user rows mentioning any event."""
+    matcher, ids_by_name = _event_matcher(events)
+    if not ids_by_name:
+        return
+    for r in rows:
+        if r.role != "user":
+            continue
+        for name in matcher.labels(r.content):
+            for event_id in ids_by_name[name]:
+                yield event_id, r
+
+
+def _row(event_id, r):
+    return {"event_id": event_id, "conversation_id": r.id, "user_id": r.user_id,
+            "day": r.created_at.date() if r.created_at else None}
+
+
+def _process(rows):
+    events = db.session.query(Event.id, Event.name).all()
+    incremental.upsert(
+        EventMention, [_row(eid, r) for eid, r in _mentions(rows, events)],
+        keys=("event_id", "conversation_id"),
+    )
+
+
+def _backfill(max_rows):
+    """Scan up to max_rows of processed history for the first queued event."""
+    B = EventMentionBackfill
+    pending = db.session.query(B).order_by(B.event_id).first()
+    if pending is None:
+        return 0
+    event = db.session.query(Event.id, Event.name).filter_by(id=pending.event_id).first()
+    rows = [] if event is None else (
+        db.session.query(
+            Conversation.id, Conversation.user_id, Conversation.role,
+            Conversation.content, Conversation.created_at,
+        )
+        .filter(Conversation.role == "user",
+                Conversation.id > pending.done_id, Conversation.id <= pending.until_id)
+        .order_by(Conversation.id.asc())
+        .limit(max_rows)
+        .all()
+    )
+    done_id = rows[-1].id if len(rows) == max_rows else pending.until_id
+    # Optimistic claim, like the watermarks: two workers never scan the same chunk
+    claimed = (
+        db.session.query(B)
+        .filter(B.event_id == pending.event_id, B.done_id == pending.done_id)
+        .update({"done_id": done_id}, synchronize_session=False)
+    )
+    if not claimed:
+        return 0
+    if event is not None:
+        incremental.upsert(
+            EventMention, [_row(eid, r) for eid, r in _mentions(rows, [event])],
+            keys=("event_id", "conversation_id"),
+        )
+    if done_id >= pending.until_id:
+        db.session.query(B).filter_by(event_id=pending.event_id).delete()
+    return max(len(rows), 1)
+
+
+def _reset():
+    db.session.query(EventMention).delete()
+    db.session.query(EventMentionBackfill).delete()
+
+
+incremental.register(JOB, _process, _reset, _backfill)
+
+
+def queue_reindex(event_id):
+    """Drop an event's mentions and queue its history scan (see _backfill).
+
+    Call in the same transaction that creates, renames or deletes the event
+    (flush first so a new event has its id); the caller commits.
+    """
+    db.session.query(EventMention).filter_by(event_id=event_id).delete()
+    db.session.query(EventMentionBackfill).filter_by(event_id=event_id).delete()
+    if db.session.query(Event.id).filter_by(id=event_id).first() is not None:
+        db.session.add(EventMentionBackfill(
+            event_id=event_id, done_id=0, until_id=incremental.watermark(JOB),
+        ))
+
+
+# ── Readers ───────────────────────────────────────────────
+
+def _tail(events, last_id):
+    """Mentions in conversations the job hasn't processed yet, or None if
+    there are too many to scan (see incremental.tail_rows)."""
+    rows = incremental.tail_rows(
+        db.session.query(
+            Conversation.id, Conversation.user_id, Conversation.role,
+            Conversation.content, Conversation.created_at,
+        ).filter(Conversation.role == "user"),
+        last_id,
+    )
+    return None if rows is None else list(_mentions(rows, events))
+
+
+def mention_counts(events):
+    """({event_id: number of user messages mentioning it}, stale) for these
+    events; stale if the job is too far behind to add its tail."""
+    ids = [e.id for e in events]
+    if not ids:
+        return {}, False
+    # Both sides split at one watermark read, so a catch-up committing
+    # meanwhile can't count a mention twice
+    last_id = incremental.watermark(JOB)
+    counts = Counter(dict(
+        db.session.query(EventMention.event_id, db.func.count())
+        .filter(EventMention.event_id.in_(ids), EventMention.conversation_id <= last_id)
+        .group_by(EventMention.event_id).all()
+    ))
+    tail = _tail(events, last_id)
+    for event_id, _ in tail or ():
+        counts[event_id] += 1
+    return {i: counts.get(i, 0) for i in ids}, tail is None
+
+
+def mention_summary(event):
+    """(mention count, unique users, [(YYYY-MM-DD, count), ...], stale) for
+    one event."""
+    M = EventMention
+    last_id = incremental.watermark(JOB)
+    indexed = (M.event_id == event.id, M.conversation_id <= last_id)
+    total, unique_users = db.session.query(
+        db.func.count(), db.func.count(db.func.distinct(M.user_id))
+    ).filter(*indexed).one()
+    daily = Counter({
+        str(day) if day else "unknown": c
+        for day, c in db.session.query(M.day, db.func.count())
+        .filter(*indexed).group_by(M.day).all()
+    })
+    tail = _tail([event], last_id)
+    tail_users = set()
+    for _, r in tail or ():
+        total += 1
+        tail_users.add(r.user_id)
+        daily[r.created_at.strftime("%Y-%m-%d") if r.created_at else "unknown"] += 1
+    if tail_users:
+        known = {
+            u for (u,) in db.session.query(M.user_id)
+            .filter(*indexed, M.user_id.in_(tail_users)).distinct()
+        }
+        unique_users += len(tail_users - known)
+    return total, unique_users, sorted(daily.items()), tail is None
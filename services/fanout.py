@@ -0,0 +1,129 @@
+"""
+Run independent read queries concurrently.
+
+Tasks are split into lanes; the calling thread runs one lane on the request's
+own session and every other lane runs on a shared worker pool inside its own
+app context, so it gets its own scoped `db.session` (and pooled connection)
+which is removed when the lane finishes. Page latency then tracks the slowest
+lane instead of the sum of round trips to pgBouncer.
+
+Connections are the limit, not threads: the dashboard fetches several
+widgets at once and each of those requests already holds a connection. A
+process-wide semaphore caps the connections fan-out may hold at once (below
+the SQLAlchemy pool, `pool_size + max_overflow` from
+`Config.SQLALCHEMY_ENGINE_OPTIONS`), and each call only takes as many extra
+lanes as the pool has free connections, keeping one spare; with none free
+the tasks simply run one after another. Override the cap with
+FANOUT_MAX_WORKERS (1 disables fan-out).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from models import db
+
+MAX_WORKERS_CAP = 6
+
+_executor = None
+_slots = None  # semaphore: connections fan-out lanes may hold, process-wide
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def _pool_capacity(app) -> int:
+    opts = app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {}
+    return opts.get("pool_size", 5) + opts.get("max_overflow", 10)
+
+
+def _max_workers(app) -> int:
+    env = os.getenv("FANOUT_MAX_WORKERS")
+    if env:
+        return max(1, int(env))
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if uri.startswith("sqlite") and (":memory:" in uri or uri.rstrip("/") == "sqlite:"):
+        return 1  # every connection would see its own empty database
+    return max(1, min(MAX_WORKERS_CAP, _pool_capacity(app) - 1))
+
+
+def _get_executor(workers):
+    global _executor, _slots
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _slots = threading.BoundedSemaphore(workers)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout")
+    return _executor
+
+
+def _free_connections(app) -> int:
+    """Connections the engine pool can still hand out without waiting."""
+    checkedout = getattr(db.engine.pool, "checkedout", None)
+    if checkedout is None:
+        return _pool_capacity(app)
+    return _pool_capacity(app) - checkedout()
+
+
+def _acquire(n) -> int:
+    """Take up to n lane slots without blocking; returns how many were taken."""
+    taken = 0
+    while taken < n and _slots.acquire(blocking=False):
+        taken += 1
+    return taken
+
+
+def _run_lane(lane):
+    """[(name, result, error)] for a lane's tasks, run one after another."""
+    out = []
+    for name, fn in lane:
+        try:
+            out.append((name, fn(), None))
+        except Exception as e:
+            out.append((name, None, e))
+    return out
+
+
+def _call(app, lane):
+    _local.in_worker = True
+    try:
+        with app.app_context():
+            return _run_lane(lane)
+    finally:
+        _local.in_worker = False
+        _slots.release()
+
+
+def run(tasks: dict) -> dict:
+    """Run {name: zero-arg callable} concurrently; returns {name: result}.
+
+    Tasks must only read: worker lanes have their own sessions, nothing is
+    committed and ORM objects they load come back detached (loaded columns
+    stay readable). The first failing task's exception is re-raised after
+    every task has finished. Runs inline when fan-out is disabled, when no
+    connection is free or when called from a task.
+    """
+    app = current_app._get_current_object()
+    workers = _max_workers(app)
+    if workers <= 1 or len(tasks) <= 1 or getattr(_local, "in_worker", False):
+        return {name: fn() for name, fn in tasks.items()}
+
+    executor = _get_executor(workers)
+    # The request's own connection may not be checked out yet: keep one spare
+    extra = _acquire(min(len(tasks) - 1, _free_connections(app) - 1))
+    items = list(tasks.items())
+    lanes = [items[i::extra + 1] for i in range(extra + 1)]
+    futures = [executor.submit(_call, app, lane) for lane in lanes[1:]]
+    _local.in_worker = True
+    try:
+        done = _run_lane(lanes[0])
+    finally:
+        _local.in_worker = False
+    for fut in futures:
+        done.extend(fut.result())
+
+    results, error = {}, None
+    for name, value, e in done:
+        results[name] = value
+        error = error or e
+    if error:
+        raise error
+    return {name: results[name] for name in tasks}
@@ -0,0 +1,76 @@
+"""
+HyperLogLog cardinality sketches.
+
+A sketch of precision p keeps m = 2**p one-byte registers; merging two
+sketches is a register-wise max, so per-day sketches can be combined over any
+date range. Relative standard error is 1.04 / sqrt(m): with the default p=12
+(4 KiB per sketch) that is ≈1.6%, i.e. the estimate is within ±3.3% of the
+true count about 95% of the time. Small counts use linear counting and are
+close to exact; the spread is somewhat wider just around the switch-over
+(≈2.5·m, ~10k distinct values at p=12).
+"""
+import hashlib
+import math
+
+DEFAULT_PRECISION = 12
+
+
+def _hash64(value) -> int:
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def standard_error(p=DEFAULT_PRECISION) -> float:
+    """Relative standard error of a precision-p sketch."""
+    return 1.04 / math.sqrt(1 << p)
+
+
+class HyperLogLog:
+    def __init__(self, p=DEFAULT_PRECISION, registers=None):
+        if not 4 <= p <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f"expected {self.m} registers, got {len(self.registers)}")
+
+    def add(self, value):
+        x = _hash64(value)
+        idx = x >> (64 - self.p)
+        rest = (x << self.p) & ((1 << 64) - 1)
+        # Position of the leftmost 1-bit in the remaining 64 - p bits
+        rank = 65 - rest.bit_length() if rest else 65 - self.p
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def update(self, values):
+        for v in values:
+            self.add(v)
+        return self
+
+    def merge(self, other):
+        """In-place union with another sketch of the same precision."""
+        if other.p != self.p:
+            raise ValueError("cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small sets
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data, p=DEFAULT_PRECISION):
+        return cls(p, data)
@@ -0,0 +1,61 @@
+"""
+Conditional JSON responses (ETag / 304 Not Modified).
+"""
+import hashlib
+from datetime import timezone
+from flask import current_app, jsonify, request
+from models import db
+
+
+def json_etag(payload, max_age=0):
+    """jsonify(payload) with a content ETag, answered with 304 when it matches.
+
+    `max_age` lets the browser reuse its copy for that many seconds; after
+    that it revalidates with If-None-Match and an unchanged widget costs a
+    304 instead of the body.
+    """
+    resp = jsonify(payload)
+    resp.add_etag()
+    resp.cache_control.private = True
+    resp.cache_control.max_age = max_age
+    resp.cache_control.must_revalidate = True
+    return resp.make_conditional(request)
+
+
+def table_version(model):
+    """(row count, latest updated_at) of a table with an `updated_at` column.
+
+    Every insert and update moves updated_at forward and every delete changes
+    the count, so the pair changes whenever the table does — read from the
+    database, it holds across processes and restarts.
+    """
+    return db.session.query(db.func.count(model.id), db.func.max(model.updated_at)).one()
+
+
+def versioned_json(version, build, max_age=0):
+    """Like json_etag, but the strong ETag comes from `version` (see
+    table_version) and the query string, so a matching If-None-Match gets
+    its 304 before `build()` queries and serializes anything.
+
+    `build()` returns the payload, or a ready response (errors, 204) that is
+    sent as is. X-Next-Since carries `updated` exactly; Last-Modified is
+    truncated to whole seconds.
+    """
+    count, updated = version
+    key = f"{request.path}?{request.query_string.decode()}|{count}|{updated and updated.isoformat()}"
+    etag = hashlib.sha1(key.encode()).hexdigest()[:24]
+    if request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+    else:
+        payload = build()
+        if isinstance(payload, current_app.response_class):
+            return payload
+        resp = jsonify(payload)
+    resp.set_etag(etag)
+    if updated:
+        resp.last_modified = updated if updated.tzinfo else updated.replace(tzinfo=timezone.utc)
+        resp.headers["X-Next-Since"] = updated.isoformat()
+    resp.cache_control.private = True
+    resp.cache_control.max_age = max_age
+    resp.cache_control.must_revalidate = True
+    return resp
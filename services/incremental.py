@@ -0,0 +1,216 @@
+"""
+Watermark-driven incremental jobs over the conversations table.
+
+Conversations are append-only and written straight to the database by the
+bot, so derived tables (rollups, tags, ...) are kept current by replaying new
+rows in id order. Each job registers a `process(rows)` callback and keeps its
+own high-water mark in `job_watermarks`; claiming a batch is an optimistic
+`UPDATE ... WHERE last_id = <old>`, so two workers never process the same rows.
+
+On Postgres ids are handed out at insert but become visible at commit, so a
+row can appear after a larger id was already claimed, and it would then be
+skipped for good (readers' tails start above the watermark too). A batch
+therefore stops at the first gap in the ids while the row after it is younger
+than COMMIT_LAG: the missing id may still be committing. Guarantee: a row is
+processed if its transaction commits within COMMIT_LAG seconds of the next
+row's created_at (the insert transaction's start with the bot's `DEFAULT
+now()`). Gaps older than that are treated as rolled back or deleted.
+"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from models import db, Conversation, JobWatermark
+from services.cache import cached
+
+BATCH_SIZE = 5000
+REQUEST_MAX_BATCHES = 4  # cap on work done inline by a page request
+CATCH_UP_INTERVAL = 60   # seconds between inline catch-ups per process
+COMMIT_LAG = 30          # seconds an id gap may still be an uncommitted insert
+TAIL_MAX_ROWS = REQUEST_MAX_BATCHES * BATCH_SIZE  # most tail rows a reader loads into Python
+
+_jobs: dict = {}
+
+
+def register(name, process, reset=None, backfill=None):
+    """Register an incremental job.
+
+    process(rows) gets a list of conversation rows (id, user_id, role,
+    content, created_at) in id order and writes derived rows into the current
+    session; reset() deletes every derived row so the job can be rebuilt.
+    backfill(max_rows) does up to max_rows of deferred work over history
+    already processed (e.g. indexing a renamed event) and returns how much it
+    did, 0 when there is none; run() calls it with the batches left over.
+    """
+    _jobs[name] = {"process": process, "reset": reset, "backfill": backfill}
+
+
+def jobs():
+    return list(_jobs)
+
+
+def watermark(name) -> int:
+    """Last conversations.id processed by job `name` (0 if never run)."""
+    return db.session.query(JobWatermark.last_id).filter_by(name=name).scalar() or 0
+
+
+def watermark_expr(name):
+    """watermark(name) as a SQL expression (a scalar subquery).
+
+    A reader that adds a derived table to the tail above the watermark must
+    read all three in one statement — one snapshot — or a catch-up committing
+    between its queries makes rows count twice or not at all.
+    """
+    return db.func.coalesce(
+        db.select(JobWatermark.last_id).where(JobWatermark.name == name).scalar_subquery(), 0
+    )
+
+
+def tail_rows(query, last_id):
+    """Rows of `query` (over conversations) above last_id in id order, or
+    None if there are more than TAIL_MAX_ROWS: the job is far behind, and the
+    reader should answer from its derived table alone and say it's stale."""
+    rows = query.filter(Conversation.id > last_id).order_by(Conversation.id).limit(TAIL_MAX_ROWS + 1).all()
+    return None if len(rows) > TAIL_MAX_ROWS else rows
+
+
+def _ensure_watermark(name):
+    if db.session.get(JobWatermark, name) is None:
+        try:
+            db.session.add(JobWatermark(name=name, last_id=0))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # another worker created it first
+
+
+def _utc(ts):
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+
+def _settled(rows, last_id):
+    """Leading rows that can be claimed: stop before the first id gap whose
+    next row is younger than COMMIT_LAG (the gap may still be committing)."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=COMMIT_LAG)
+    prev = last_id
+    for i, r in enumerate(rows):
+        if r.id != prev + 1 and r.created_at is not None and _utc(r.created_at) >= cutoff:
+            return rows[:i]
+        prev = r.id
+    return rows
+
+
+def run(name, max_batches=None) -> int:
+    """Process new conversations for job `name`; returns rows processed."""
+    job = _jobs[name]
+    _ensure_watermark(name)
+    processed = batches = 0
+    while max_batches is None or batches < max_batches:
+        last_id = watermark(name)
+        rows = (
+            db.session.query(
+                Conversation.id, Conversation.user_id, Conversation.role,
+                Conversation.content, Conversation.created_at,
+            )
+            .filter(Conversation.id > last_id)
+            .order_by(Conversation.id.asc())
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        rows = _settled(rows, last_id)
+        if not rows:
+            db.session.rollback()
+            break
+        claimed = (
+            db.session.query(JobWatermark)
+            .filter(JobWatermark.name == name, JobWatermark.last_id == last_id)
+            .update({"last_id": rows[-1].id, "updated_at": datetime.now(timezone.utc)},
+                    synchronize_session=False)
+        )
+        if not claimed:
+            db.session.rollback()  # another worker is on this batch
+            break
+        try:
+            job["process"](rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        processed += len(rows)
+        batches += 1
+        if len(rows) < BATCH_SIZE:
+            break
+    while job["backfill"] and (max_batches is None or batches < max_batches):
+        try:
+            done = job["backfill"](BATCH_SIZE)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if not done:
+            break
+        batches += 1
+    return processed
+
+
+def run_all(max_batches=None) -> dict:
+    return {name: run(name, max_batches) for name in _jobs}
+
+
+def reset(name):
+    """Delete a job's derived rows and rewind its watermark to 0."""
+    job = _jobs[name]
+    if job["reset"]:
+        job["reset"]()
+    db.session.query(JobWatermark).filter_by(name=name).delete()
+    db.session.commit()
+
+
+def catch_up():
+    """Bounded inline catch-up, at most once per CATCH_UP_INTERVAL per process.
+
+    Keeps derived tables within about a minute of the bot without a separate
+    scheduler; a full backfill goes through `flask jobs run`.
+    """
+    def _run():
+        try:
+            return run_all(REQUEST_MAX_BATCHES)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[WARNING] Incremental catch-up failed: {e}")
+            return {}
+
+    return cached("incremental_catch_up", _run, ttl=CATCH_UP_INTERVAL)
+
+
+def upsert(model, rows, keys, add=(), least=(), greatest=()):
+    """INSERT ... ON CONFLICT (keys) DO UPDATE for SQLite and Postgres.
+
+    Columns in `add` are summed with the existing value, `least`/`greatest`
+    keep the min/max of old and new; anything else is left as inserted.
+    """
+    if not rows:
+        return
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert not supported on {dialect}")
+
+    table = model.__table__
+    for i in range(0, len(rows), 500):
+        stmt = insert(table).values(rows[i:i + 500])
+        new = stmt.excluded
+        set_ = {c: table.c[c] + new[c] for c in add}
+        set_.update({
+            c: db.case((table.c[c].is_(None), new[c]), (new[c] < table.c[c], new[c]), else_=table.c[c])
+            for c in least
+        })
+        set_.update({
+            c: db.case((table.c[c].is_(None), new[c]), (new[c] > table.c[c], new[c]), else_=table.c[c])
+            for c in greatest
+        })
+        if set_:
+            stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(keys))
+        db.session.execute(stmt)
@@ -0,0 +1,161 @@
+"""
+Batched ingestion of messages and conversation turns.
+
+A batch is a JSON array of row objects or NDJSON (one object per line, sent
+as application/x-ndjson). Every row is validated on its own and the invalid
+ones are reported by position; the valid ones are written in a single
+transaction with one executemany (insertmanyvalues), or with COPY on Postgres
+for large batches.
+"""
+import json
+from datetime import datetime, timezone
+from models import db, Conversation, Message
+from services.invalidation import mark_written
+
+MAX_ROWS = 5000
+MAX_BYTES = 5 * 1024 * 1024
+COPY_MIN_ROWS = 200  # below this a multi-row INSERT is as fast as COPY
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+class BatchError(ValueError):
+    """The batch as a whole is unusable (malformed, too large); has an HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse(body: bytes, content_type: str) -> list:
+    """[(index, object or None, error or None)] from a JSON array or NDJSON body."""
+    if len(body) > MAX_BYTES:
+        raise BatchError(f"Batch larger than {MAX_BYTES // (1024 * 1024)} MB", 413)
+    text = body.decode("utf-8", errors="replace")
+    if (content_type or "").split(";")[0].strip() in NDJSON_TYPES:
+        items = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append((json.loads(line), None))
+            except ValueError as e:
+                items.append((None, f"Invalid JSON: {e}"))
+    else:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise BatchError(f"Invalid JSON: {e}")
+        if not isinstance(data, list):
+            raise BatchError("Expected a JSON array of rows (or NDJSON)")
+        items = [(row, None) for row in data]
+    if not items:
+        raise BatchError("Empty batch")
+    if len(items) > MAX_ROWS:
+        raise BatchError(f"Batch has {len(items)} rows, the limit is {MAX_ROWS}", 413)
+    return [(i, obj, err) for i, (obj, err) in enumerate(items)]
+
+
+# ── Row validation ─────────────────────────────────────────
+
+def _text(row, key, max_len=None, default=None, required=False):
+    value = row.get(key, default)
+    if value is None or (required and value == ""):
+        if required:
+            raise ValueError(f"'{key}' is required")
+        return default
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        raise ValueError(f"'{key}' must be a string")
+    value = str(value)
+    if max_len and len(value) > max_len:
+        raise ValueError(f"'{key}' is longer than {max_len} characters")
+    return value
+
+
+def _timestamp(row, key):
+    """Naive UTC, so INSERT and COPY store the same value whatever the session time zone."""
+    value = row.get(key)
+    if value in (None, ""):
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"'{key}' is not an ISO 8601 timestamp")
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+
+def _message(row):
+    return {
+        "user_id": _text(row, "user_id", 100, default="unknown"),
+        "user_name": _text(row, "user_name", 200, default="Unknown"),
+        "message": _text(row, "message", default=""),
+        "response": _text(row, "response", default=""),
+        "platform": _text(row, "platform", 50, default="whatsapp"),
+        "timestamp": _timestamp(row, "timestamp"),
+    }
+
+
+def _conversation(row):
+    role = _text(row, "role", 20, required=True)
+    if role not in ("user", "assistant"):
+        raise ValueError("'role' must be 'user' or 'assistant'")
+    return {
+        "user_id": _text(row, "user_id", 100, required=True),
+        "role": role,
+        "content": _text(row, "content", required=True),
+        "created_at": _timestamp(row, "created_at"),
+    }
+
+
+TARGETS = {
+    "messages": (Message, _message),
+    "conversations": (Conversation, _conversation),
+}
+
+
+def validate(target, items):
+    """(valid rows, [{"index", "error"}]) for parsed items."""
+    _, clean = TARGETS[target]
+    rows, errors = [], []
+    for i, obj, err in items:
+        if err is None and not isinstance(obj, dict):
+            err = "Row must be a JSON object"
+        if err is None:
+            try:
+                rows.append(clean(obj))
+                continue
+            except ValueError as e:
+                err = str(e)
+        errors.append({"index": i, "error": err})
+    return rows, errors
+
+
+# ── Writing ────────────────────────────────────────────────
+
+def _copy(model, rows):
+    """COPY rows into model's table on the session's own connection/transaction."""
+    columns = list(rows[0])
+    raw = db.session.connection().connection.driver_connection
+    with raw.cursor() as cur:
+        with cur.copy(f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN") as copy:
+            for r in rows:
+                copy.write_row([r[c] for c in columns])
+    mark_written(db.session, model.__tablename__)
+
+
+def insert(target, rows) -> int:
+    """Insert validated rows in one transaction; returns the number written."""
+    model, _ = TARGETS[target]
+    if not rows:
+        return 0
+    try:
+        engine = db.engine
+        if (engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg"
+                and len(rows) >= COPY_MIN_ROWS):
+            _copy(model, rows)
+        else:
+            db.session.execute(db.insert(model), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
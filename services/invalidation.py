@@ -0,0 +1,53 @@
+"""
+Commit-driven cache invalidation.
+
+Records which tables a session wrote to (unit-of-work flushes and bulk
+INSERT/UPDATE/DELETE statements) and, once the transaction commits, drops the
+cache entries that declared a dependency on them (see services.cache).
+Rolled-back writes invalidate nothing.
+"""
+from sqlalchemy import event
+from services.cache import invalidate_tables
+
+_INFO_KEY = "dirty_tables"
+
+
+def _mark(session, tables):
+    session.info.setdefault(_INFO_KEY, set()).update(t for t in tables if t)
+
+
+def mark_written(session, *tables):
+    """Record writes the hooks can't see (raw DBAPI, e.g. COPY)."""
+    _mark(session, tables)
+
+
+def _after_flush(session, flush_context):
+    _mark(session, (
+        obj.__table__.name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if hasattr(obj, "__table__")
+    ))
+
+
+def _do_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        _mark(orm_execute_state.session, [getattr(table, "name", None)])
+
+
+def _after_commit(session):
+    tables = session.info.pop(_INFO_KEY, None)
+    if tables:
+        invalidate_tables(tables)
+
+
+def _after_rollback(session):
+    session.info.pop(_INFO_KEY, None)
+
+
+def install(session):
+    """Attach the tracking hooks to a session (or scoped_session / sessionmaker)."""
+    event.listen(session, "after_flush", _after_flush)
+    event.listen(session, "do_orm_execute", _do_orm_execute)
+    event.listen(session, "after_commit", _after_commit)
+    event.listen(session, "after_rollback", _after_rollback)
@@ -0,0 +1,285 @@
+"""
+Monthly partitioning and cold archival of the conversations table.
+
+Postgres: `conversations` becomes a declarative range-partitioned table on
+`created_at`, one partition per month (`conversations_pYYYY_MM`) plus a
+default partition for anything outside them. Queries bounded on created_at
+only touch the partitions they need, and every index is per partition, so
+their size is bounded by a month of messages. `flask partitions convert`
+migrates an existing table once; `flask partitions ensure` (run it from a
+monthly cron) creates the coming months ahead of time.
+
+Archiving moves whole old months out of the live table:
+ - Postgres: each partition is written to `<ARCHIVE_DIR>/conversations-YYYY-MM.csv.gz`,
+   then detached and dropped.
+ - SQLite: rows are moved into a `conversations_archive` table.
+Archived messages are no longer shown in the app but remain in the CSV export
+(`archived_rows`). Rollups keep their history, but only rows every
+incremental job has processed are archived, and `flask jobs rebuild` after an
+archive only sees live rows.
+"""
+import csv
+import gzip
+import os
+from datetime import datetime, timezone
+from sqlalchemy import text
+from models import db, Conversation
+from services import incremental
+
+ARCHIVE_DIR = os.getenv("CONVERSATION_ARCHIVE_DIR", "archive")
+MONTHS_AHEAD = 3
+MOVE_BATCH = 5000  # rows moved per statement on SQLite
+
+COLUMNS = ("id", "user_id", "role", "content", "created_at")
+
+_archive_meta = db.MetaData()
+archive_table = db.Table(
+    "conversations_archive", _archive_meta,
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("user_id", db.String(100), nullable=False),
+    db.Column("role", db.String(20), nullable=False),
+    db.Column("content", db.Text, nullable=False),
+    db.Column("created_at", db.DateTime),
+    db.Index("ix_conversations_archive_created_at", "created_at"),
+)
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _month_start(d):
+    return datetime(d.year, d.month, 1)
+
+
+def _add_months(d, n):
+    y, m = divmod(d.month - 1 + n, 12)
+    return datetime(d.year + y, m + 1, 1)
+
+
+def _partition_name(month):
+    return f"conversations_p{month:%Y_%m}"
+
+
+def _safe_id() -> int:
+    """Highest conversations.id every incremental job has already processed."""
+    marks = [incremental.watermark(name) for name in incremental.jobs()]
+    return min(marks) if marks else 0
+
+
+# ── Postgres ───────────────────────────────────────────────
+
+def is_partitioned() -> bool:
+    if _dialect() != "postgresql":
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('conversations')"
+    )).first() is not None
+
+
+def _create_partition(month):
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF conversations"
+        f" FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+    ))
+
+
+def ensure(months_ahead=MONTHS_AHEAD) -> list:
+    """Create this month's and the next `months_ahead` partitions; returns their names."""
+    if not is_partitioned():
+        raise RuntimeError("conversations is not partitioned (run `flask partitions convert`)")
+    month = _month_start(datetime.now(timezone.utc))
+    months = [_add_months(month, i) for i in range(months_ahead + 1)]
+    for m in months:
+        _create_partition(m)
+    db.session.commit()
+    return [_partition_name(m) for m in months]
+
+
+def convert(months_ahead=MONTHS_AHEAD) -> int:
+    """One-time migration of a plain `conversations` table to monthly partitions.
+
+    Copies every row inside a single transaction holding an exclusive lock,
+    so writes from the bot wait until it finishes — run it in a quiet window.
+    Returns the number of partitions created.
+    """
+    if _dialect() != "postgresql":
+        raise RuntimeError("partitioning is only available on Postgres")
+    if is_partitioned():
+        return 0
+    cols = ", ".join(COLUMNS)
+    old = "conversations_unpartitioned"
+    s = db.session
+    s.execute(text("LOCK TABLE conversations IN ACCESS EXCLUSIVE MODE"))
+    first = s.execute(text("SELECT min(created_at) FROM conversations")).scalar()
+    s.execute(text(f"ALTER TABLE conversations RENAME TO {old}"))
+    s.execute(text(
+        f"CREATE TABLE conversations (LIKE {old} INCLUDING DEFAULTS INCLUDING GENERATED"
+        " INCLUDING IDENTITY) PARTITION BY RANGE (created_at)"
+    ))
+    # The partition key has to be part of the primary key, which makes it NOT
+    # NULL; rows inserted without a timestamp get the insert time
+    s.execute(text("ALTER TABLE conversations ALTER COLUMN created_at SET DEFAULT now()"))
+    s.execute(text("ALTER TABLE conversations ADD PRIMARY KEY (id, created_at)"))
+    seq = s.execute(text(f"SELECT pg_get_serial_sequence('{old}', 'id')")).scalar()
+    if seq:  # SERIAL: hand the sequence over before the old table is dropped
+        s.execute(text(f"ALTER SEQUENCE {seq} OWNED BY conversations.id"))
+
+    now = _month_start(datetime.now(timezone.utc))
+    month = _month_start(first) if first else now
+    created = 0
+    while month <= _add_months(now, months_ahead):
+        _create_partition(month)
+        month = _add_months(month, 1)
+        created += 1
+    s.execute(text("CREATE TABLE conversations_default PARTITION OF conversations DEFAULT"))
+
+    s.execute(text(
+        f"INSERT INTO conversations ({cols})"
+        f" SELECT id, user_id, role, content, coalesce(created_at, now()) FROM {old}"
+    ))
+    s.execute(text(f"DROP TABLE {old}"))
+    s.execute(text(
+        "SELECT setval(pg_get_serial_sequence('conversations', 'id'),"
+        " (SELECT coalesce(max(id), 1) FROM conversations))"
+    ))
+    # Partitioned indexes: created on the parent, built per partition
+    for index in Conversation.__table__.indexes:
+        index.create(s.connection())
+    has_tsv = s.execute(text(
+        "SELECT 1 FROM information_schema.columns"
+        " WHERE table_name = 'conversations' AND column_name = 'content_tsv'"
+    )).first() is not None
+    if has_tsv:
+        s.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_conversations_content_tsv ON conversations USING GIN (content_tsv)"
+        ))
+    s.commit()
+    s.execute(text("ANALYZE conversations"))
+    s.commit()
+    return created
+
+
+def partitions() -> list:
+    """[{name, bounds, rows (estimate), bytes}] for each partition, oldest first."""
+    if not is_partitioned():
+        return []
+    rows = db.session.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint,"
+        " pg_total_relation_size(c.oid)"
+        " FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass('conversations') ORDER BY c.relname"
+    )).all()
+    return [{"name": n, "bounds": b, "rows": max(r, 0), "bytes": size} for n, b, r, size in rows]
+
+
+def _write_archive(path, result):
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        n = 0
+        for r in result:
+            writer.writerow([r.id, r.user_id, r.role, r.content,
+                             r.created_at.isoformat() if r.created_at else ""])
+            n += 1
+    os.replace(tmp, path)
+    return n
+
+
+def _archive_partitions(cutoff, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    safe_id = _safe_id()
+    done = []
+    for p in partitions():
+        try:
+            month = datetime.strptime(p["name"], "conversations_p%Y_%m")
+        except ValueError:
+            continue  # the default partition
+        if _add_months(month, 1) > cutoff:
+            continue
+        name = p["name"]
+        max_id = db.session.execute(text(f"SELECT max(id) FROM {name}")).scalar() or 0
+        if max_id > safe_id:
+            print(f"[WARNING] {name} has rows not yet processed by every job, skipped")
+            continue
+        path = os.path.join(out_dir, f"conversations-{month:%Y-%m}.csv.gz")
+        result = db.session.execute(
+            text(f"SELECT {', '.join(COLUMNS)} FROM {name} ORDER BY created_at, id")
+            .execution_options(yield_per=5000)
+        )
+        n = _write_archive(path, result)
+        db.session.execute(text(f"ALTER TABLE conversations DETACH PARTITION {name}"))
+        db.session.execute(text(f"DROP TABLE {name}"))
+        db.session.commit()
+        done.append({"month": f"{month:%Y-%m}", "rows": n, "path": path})
+    return done
+
+
+# ── SQLite fallback ────────────────────────────────────────
+
+def _archive_rows_to_table(cutoff):
+    archive_table.create(db.engine, checkfirst=True)
+    C = Conversation
+    where = (C.created_at < cutoff, C.id <= _safe_id())
+    moved = 0
+    while True:
+        ids = [i for (i,) in db.session.query(C.id).filter(*where).order_by(C.id).limit(MOVE_BATCH)]
+        if not ids:
+            break
+        db.session.execute(archive_table.insert().from_select(
+            list(COLUMNS),
+            db.select(C.id, C.user_id, C.role, C.content, C.created_at).where(C.id.in_(ids)),
+        ))
+        db.session.query(C).filter(C.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        moved += len(ids)
+    return [{"month": f"< {cutoff:%Y-%m}", "rows": moved, "path": archive_table.name}] if moved else []
+
+
+def archive(older_than_months, out_dir=ARCHIVE_DIR) -> list:
+    """Archive every month that ended more than `older_than_months` months ago."""
+    cutoff = _add_months(_month_start(datetime.now(timezone.utc)), -older_than_months)
+    if is_partitioned():
+        return _archive_partitions(cutoff, out_dir)
+    if _dialect() == "sqlite":
+        return _archive_rows_to_table(cutoff)
+    raise RuntimeError("archiving needs a partitioned table (run `flask partitions convert`)")
+
+
+# ── Reading archived rows ──────────────────────────────────
+
+def archived_rows(since=None, until=None, user_id=None, out_dir=ARCHIVE_DIR):
+    """Archived messages in [since, until) ordered by created_at, as
+    (id, user_id, role, content, created_at) tuples — from the archive files
+    and, on SQLite, the archive table."""
+    if os.path.isdir(out_dir):
+        for fname in sorted(os.listdir(out_dir)):
+            if not (fname.startswith("conversations-") and fname.endswith(".csv.gz")):
+                continue
+            month = datetime.strptime(fname[len("conversations-"):-len(".csv.gz")], "%Y-%m")
+            if (until and month >= until) or (since and _add_months(month, 1) <= since):
+                continue
+            with gzip.open(os.path.join(out_dir, fname), "rt", encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                for id_, uid, role, content, created in reader:
+                    created = datetime.fromisoformat(created) if created else None
+                    if user_id and uid != user_id:
+                        continue
+                    if created and ((since and created < since) or (until and created >= until)):
+                        continue
+                    yield int(id_), uid, role, content, created
+
+    if _dialect() == "sqlite" and db.inspect(db.engine).has_table(archive_table.name):
+        t = archive_table.c
+        stmt = db.select(t.id, t.user_id, t.role, t.content, t.created_at)
+        if since:
+            stmt = stmt.where(t.created_at >= since)
+        if until:
+            stmt = stmt.where(t.created_at < until)
+        if user_id:
+            stmt = stmt.where(t.user_id == user_id)
+        yield from db.session.execute(
+            stmt.order_by(t.created_at, t.id).execution_options(yield_per=1000)
+        )
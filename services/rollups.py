@@ -0,0 +1,328 @@
+"""
+Pre-aggregated conversation analytics.
+
+Three rollups of user messages, maintained incrementally by the "rollups"
+job (services.incremental) from the conversations table:
+ - conversation_hourly:     (day, hour) -> messages          O(days × 24)
+ - conversation_user_daily: (day, user_id) -> messages       O(user-days)
+ - conversation_users:      user_id -> count, first/last seen, days active
+
+Readers combine the rollups with the "tail" — conversations newer than the
+job's watermark — in one statement, so results are exact even between (and
+during) catch-ups.
+"""
+import os
+from collections import Counter
+from models import db, Conversation, ConversationHourly, ConversationUserDaily, ConversationUser, JobWatermark
+from services import incremental, sketches, tagging
+
+JOB = "rollups"
+
+# "exact" or "approx" (HyperLogLog) for ranged distinct-user counts
+DISTINCT_USERS_MODE = os.getenv("DISTINCT_USERS_MODE", "exact").lower()
+
+
+def _process(rows):
+    hourly, user_daily, users = Counter(), Counter(), {}
+    for r in rows:
+        if r.role != "user" or r.created_at is None:
+            continue
+        day = r.created_at.date()
+        hourly[(day, r.created_at.hour)] += 1
+        user_daily[(day, r.user_id)] += 1
+        u = users.get(r.user_id)
+        if u is None:
+            users[r.user_id] = {"user_id": r.user_id, "msg_count": 1, "days_active": 0,
+                                "first_seen": r.created_at, "last_seen": r.created_at}
+        else:
+            u["msg_count"] += 1
+            # Id order isn't time order (backfills, replays): keep the extremes
+            u["first_seen"] = min(u["first_seen"], r.created_at)
+            u["last_seen"] = max(u["last_seen"], r.created_at)
+
+    incremental.upsert(
+        ConversationHourly,
+        [{"day": d, "hour": h, "msg_count": c} for (d, h), c in hourly.items()],
+        keys=("day", "hour"), add=("msg_count",),
+    )
+    incremental.upsert(
+        ConversationUserDaily,
+        [{"day": d, "user_id": u, "msg_count": c} for (d, u), c in user_daily.items()],
+        keys=("day", "user_id"), add=("msg_count",),
+    )
+    incremental.upsert(
+        ConversationUser, list(users.values()),
+        keys=("user_id",), add=("msg_count",), least=("first_seen",), greatest=("last_seen",),
+    )
+    _refresh_days_active(list(users))
+
+
+def _refresh_days_active(user_ids):
+    days = (
+        db.select(db.func.count())
+        .where(ConversationUserDaily.user_id == ConversationUser.user_id)
+        .scalar_subquery()
+    )
+    for i in range(0, len(user_ids), 500):
+        (
+            db.session.query(ConversationUser)
+            .filter(ConversationUser.user_id.in_(user_ids[i:i + 500]))
+            .update({"days_active": days}, synchronize_session=False)
+        )
+
+
+def _reset():
+    for model in (ConversationHourly, ConversationUserDaily, ConversationUser):
+        db.session.query(model).delete()
+
+
+incremental.register(JOB, _process, _reset)
+
+
+# ── Readers ───────────────────────────────────────────────
+#
+# Each reader is a single statement: the tail filter reads the watermark in
+# SQL (incremental.watermark_expr), so the rollups, the watermark and the
+# tail come from one snapshot even while a catch-up commits.
+
+def _tail():
+    """Filter for user messages not yet folded into the rollups."""
+    return (Conversation.role == "user", Conversation.id > incremental.watermark_expr(JOB))
+
+
+def message_totals(today_start, week_start, month_start):
+    """User message counts: (today, this week, this month, all time)."""
+    H = ConversationHourly
+    rolled = db.select(
+        db.func.coalesce(db.func.sum(H.msg_count).filter(H.day >= today_start.date()), 0),
+        db.func.coalesce(db.func.sum(H.msg_count).filter(H.day >= week_start.date()), 0),
+        db.func.coalesce(db.func.sum(H.msg_count).filter(H.day >= month_start.date()), 0),
+        db.func.coalesce(db.func.sum(H.msg_count), 0),
+    ).subquery()
+    tail = db.select(
+        db.func.count(Conversation.id).filter(Conversation.created_at >= today_start),
+        db.func.count(Conversation.id).filter(Conversation.created_at >= week_start),
+        db.func.count(Conversation.id).filter(Conversation.created_at >= month_start),
+        db.func.count(Conversation.id),
+    ).where(*_tail()).subquery()
+    row = db.session.execute(
+        db.select(*rolled.c, *tail.c).select_from(rolled.join(tail, db.true()))
+    ).one()
+    return tuple(int(a) + int(b) for a, b in zip(row[:4], row[4:]))
+
+
+def total_messages() -> int:
+    """All-time user message count."""
+    rolled = db.select(db.func.coalesce(db.func.sum(ConversationHourly.msg_count), 0)).scalar_subquery()
+    tail = db.select(db.func.count(Conversation.id)).where(*_tail()).scalar_subquery()
+    return int(db.session.execute(db.select(rolled + tail)).scalar())
+
+
+def daily_counts(start):
+    """{'YYYY-MM-DD': user messages} for every day since `start` (a datetime)."""
+    H = ConversationHourly
+    tail_day = db.func.date(Conversation.created_at)
+    counts = Counter()
+    for day, c in db.session.execute(db.union_all(
+        db.select(H.day, db.func.sum(H.msg_count)).where(H.day >= start.date()).group_by(H.day),
+        db.select(tail_day, db.func.count(Conversation.id))
+        .where(*_tail(), Conversation.created_at >= start).group_by(tail_day),
+    )):
+        counts[str(day)] += int(c)
+    return counts
+
+
+def hourly_counts():
+    """{hour: user messages} over the whole history."""
+    H = ConversationHourly
+    tail_hour = db.extract("hour", Conversation.created_at)
+    counts = Counter()
+    for h, c in db.session.execute(db.union_all(
+        db.select(H.hour, db.func.sum(H.msg_count)).group_by(H.hour),
+        db.select(tail_hour, db.func.count(Conversation.id)).where(*_tail()).group_by(tail_hour),
+    )):
+        counts[int(h)] += int(c)
+    return counts
+
+
+def distinct_users(start=None, end=None, approx=None) -> int:
+    """Users with at least one message in [start, end) (datetimes), or ever.
+
+    approx=True merges the per-day HyperLogLog sketches (services.sketches)
+    instead of a DISTINCT over user-days; None follows DISTINCT_USERS_MODE.
+    All-time counts stay exact — conversation_users already has one row per
+    user.
+    """
+    if approx is None:
+        approx = DISTINCT_USERS_MODE == "approx"
+    if approx and (start is not None or end is not None):
+        return sketches.distinct_users(start, end)
+
+    U = ConversationUserDaily
+    if start is None and end is None:
+        rolled = db.select(ConversationUser.user_id)
+    else:
+        rolled = db.select(U.user_id)
+        if start is not None:
+            rolled = rolled.where(U.day >= start.date())
+        if end is not None:
+            rolled = rolled.where(U.day < end.date())
+    tail = db.select(Conversation.user_id).where(*_tail())
+    if start is not None:
+        tail = tail.where(Conversation.created_at >= start)
+    if end is not None:
+        tail = tail.where(Conversation.created_at < end)
+    both = db.union(rolled, tail).subquery()
+    return db.session.execute(db.select(db.func.count()).select_from(both)).scalar() or 0
+
+
+def user_page(limit, after=None, user_filter=None):
+    """One page of users, most recently active first, ordered by (last_active, user_id).
+
+    `after` is the (last_active, user_id) of the previous page's last row.
+    `user_filter(col)` optionally returns a clause on a user_id column. The
+    page is a keyset scan of conversation_users; users with messages in the
+    tail are merged with their raw rows and left out of that scan, so each
+    user shows up once with exact figures. Returns (rows, has_more).
+    """
+    U, C = ConversationUser, Conversation
+    tail = _tail()
+    tail_users = db.select(C.user_id).where(*tail)
+
+    settled = db.select(
+        U.user_id, U.msg_count, U.first_seen, U.last_seen.label("last_active"),
+    ).where(U.user_id.not_in(tail_users))
+    parts = db.union_all(
+        db.select(U.user_id, U.msg_count, U.first_seen, U.last_seen.label("last_active"))
+        .where(U.user_id.in_(tail_users)),
+        db.select(C.user_id, db.func.count(C.id), db.func.min(C.created_at), db.func.max(C.created_at))
+        .where(*tail).group_by(C.user_id),
+    ).subquery()
+    fresh = db.select(
+        parts.c.user_id,
+        db.func.sum(parts.c.msg_count),
+        db.func.min(parts.c.first_seen),
+        db.func.max(parts.c.last_active),
+    ).group_by(parts.c.user_id)
+    if user_filter is not None:
+        settled = settled.where(user_filter(U.user_id))
+        fresh = fresh.where(user_filter(parts.c.user_id))
+    if after is not None:
+        settled = settled.where(db.tuple_(U.last_seen, U.user_id) < db.tuple_(*after))
+        fresh = fresh.having(db.tuple_(db.func.max(parts.c.last_active), parts.c.user_id) < db.tuple_(*after))
+    settled = settled.order_by(U.last_seen.desc(), U.user_id.desc()).limit(limit + 1).subquery()
+
+    page = db.union_all(db.select(settled), fresh).subquery()
+    rows = db.session.execute(
+        db.select(page).order_by(page.c.last_active.desc(), page.c.user_id.desc()).limit(limit + 1)
+    ).all()
+    merged = [
+        {"user_id": r.user_id, "msg_count": int(r.msg_count),
+         "first_seen": r.first_seen, "last_active": r.last_active}
+        for r in rows
+    ]
+    return merged[:limit], len(merged) > limit
+
+
+def users():
+    """Subquery with one row per user: user_id, msg_count, first_seen,
+    last_seen, days_active.
+
+    conversation_users as is for users with nothing in the tail; users with
+    tail messages are recomputed from their rollup row plus those messages
+    (days from conversation_user_daily ∪ tail days), so figures are exact
+    and the work beyond an indexed read of the summary is bounded by the
+    tail.
+    """
+    U, D, C = ConversationUser, ConversationUserDaily, Conversation
+    tail = _tail()
+    tail_users = db.select(C.user_id).where(*tail).distinct()
+
+    settled = db.select(
+        U.user_id, U.msg_count, U.first_seen, U.last_seen, U.days_active,
+    ).where(U.user_id.not_in(tail_users))
+
+    parts = db.union_all(
+        db.select(U.user_id, U.msg_count, U.first_seen, U.last_seen)
+        .where(U.user_id.in_(tail_users)),
+        db.select(C.user_id, db.func.count(C.id), db.func.min(C.created_at), db.func.max(C.created_at))
+        .where(*tail).group_by(C.user_id),
+    ).subquery()
+    days = db.union(
+        db.select(D.user_id.label("user_id"), D.day.label("day")).where(D.user_id.in_(tail_users)),
+        db.select(C.user_id.label("user_id"), db.func.date(C.created_at).label("day")).where(*tail),
+    ).subquery()
+    day_counts = (
+        db.select(days.c.user_id, db.func.count().label("days_active"))
+        .group_by(days.c.user_id).subquery()
+    )
+    fresh = (
+        db.select(
+            parts.c.user_id,
+            db.func.sum(parts.c.msg_count),
+            db.func.min(parts.c.first_seen),
+            db.func.max(parts.c.last_seen),
+            db.func.max(day_counts.c.days_active),
+        )
+        .select_from(parts.join(day_counts, day_counts.c.user_id == parts.c.user_id))
+        .group_by(parts.c.user_id)
+    )
+    return db.union_all(settled, fresh).subquery("users")
+
+
+def returning_users() -> int:
+    """Users with more than one message."""
+    u = users()
+    return db.session.execute(
+        db.select(db.func.count()).select_from(u).where(u.c.msg_count > 1)
+    ).scalar() or 0
+
+
+def rebuild_users():
+    """Recompute conversation_users in one INSERT ... SELECT over the messages
+    already covered by the rollups watermark (the tail stays to the job, so
+    nothing is counted twice). Returns the number of users written.
+    """
+    C, U = Conversation, ConversationUser
+    # Hold the job's watermark row until commit, so an inline catch-up can't
+    # claim and upsert a batch between the DELETE and the INSERT (it waits and
+    # then continues from the watermark). SQLite ignores FOR UPDATE, but the
+    # DELETE takes its write lock, so the watermark is read after it.
+    db.session.query(JobWatermark).filter_by(name=JOB).with_for_update().first()
+    db.session.query(U).delete()
+    last_id = incremental.watermark(JOB)
+    db.session.execute(
+        db.insert(U).from_select(
+            ["user_id", "msg_count", "first_seen", "last_seen", "days_active"],
+            db.select(
+                C.user_id,
+                db.func.count(C.id),
+                db.func.min(C.created_at),
+                db.func.max(C.created_at),
+                db.func.count(db.distinct(db.func.date(C.created_at))),
+            )
+            .where(C.role == "user", C.created_at.isnot(None), C.id <= last_id)
+            .group_by(C.user_id),
+        )
+    )
+    db.session.commit()
+    return db.session.query(db.func.count()).select_from(U).scalar()
+
+
+def funnel() -> dict:
+    """Total users, how many came back and how many asked about RRPP (+ rates %).
+
+    rrpp_stale: the tagger is too far behind to count its tail (see
+    tagging.count_users).
+    """
+    total = distinct_users()
+    returning = returning_users()
+    rrpp, rrpp_stale = tagging.count_users(tagging.TAG_RRPP)
+    return {
+        "total_users": total,
+        "returning_users": returning,
+        "rrpp_users": rrpp,
+        "rrpp_stale": rrpp_stale,
+        "retention_rate": round((returning / total) * 100, 1) if total else 0,
+        "rrpp_interest_rate": round((rrpp / total) * 100, 1) if total else 0,
+    }
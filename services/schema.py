@@ -0,0 +1,99 @@
+"""
+Model indexes on tables that already exist.
+
+db.create_all() only indexes the tables it creates. On SQLite the missing
+indexes are cheap and created at startup. On Postgres a plain CREATE INDEX
+blocks writes to the table while it builds (the bot's INSERTs into
+conversations), so they are built with CREATE INDEX CONCURRENTLY by
+`flask schema indexes` instead; run it from the CLI, not on a request.
+"""
+from sqlalchemy import text
+from models import db, Conversation, ConversationUser
+
+# Models whose indexes were added after their tables existed in production
+MODELS = (Conversation, ConversationUser)
+
+
+def _index_state(conn, name):
+    """None if the index doesn't exist, else whether it's valid (a failed
+    CONCURRENTLY build leaves an invalid index behind)."""
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid"
+        " WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": name}).scalar()
+
+
+def _columns(index):
+    return ", ".join(c.name for c in index.columns)
+
+
+def _create_concurrently(conn, name, table, index, only=False):
+    state = _index_state(conn, name)
+    if state:
+        return False
+    if state is False:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+    unique = "UNIQUE " if index.unique else ""
+    if only:  # partitioned parent: CONCURRENTLY isn't allowed, ON ONLY is instant
+        conn.execute(text(f"CREATE {unique}INDEX {name} ON ONLY {table} ({_columns(index)})"))
+    else:
+        conn.execute(text(f"CREATE {unique}INDEX CONCURRENTLY {name} ON {table} ({_columns(index)})"))
+    return True
+
+
+def _partitions(conn, table):
+    return [r for (r,) in conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(:t) ORDER BY c.relname"
+    ), {"t": table})]
+
+
+def _attached(conn, child, parent):
+    return conn.execute(text(
+        "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:child)"
+        " AND inhparent = to_regclass(:parent)"
+    ), {"child": child, "parent": parent}).first() is not None
+
+
+def _create_postgres(models):
+    created = []
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for model in models:
+            table = model.__tablename__
+            partitioned = conn.execute(text(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t)"
+            ), {"t": table}).first() is not None
+            for index in model.__table__.indexes:
+                if not partitioned:
+                    if _create_concurrently(conn, index.name, table, index):
+                        created.append(index.name)
+                    continue
+                # Build each partition's index without blocking writes, then
+                # attach it; the parent index turns valid once all are attached
+                made = _create_concurrently(conn, index.name, table, index, only=True)
+                for partition in _partitions(conn, table):
+                    child = f"{index.name}_{partition}"[:63]
+                    _create_concurrently(conn, child, partition, index)
+                    if not _attached(conn, child, index.name):
+                        conn.execute(text(f"ALTER INDEX {index.name} ATTACH PARTITION {child}"))
+                if made:
+                    created.append(index.name)
+    return created
+
+
+def create_indexes(models=MODELS) -> list:
+    """Create the models' missing indexes; returns the names created."""
+    if db.engine.dialect.name == "postgresql":
+        return _create_postgres(models)
+    existing = {
+        i["name"]
+        for model in models
+        for i in db.inspect(db.engine).get_indexes(model.__tablename__)
+    }
+    created = []
+    for model in models:
+        for index in model.__table__.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
@@ -0,0 +1,179 @@
+"""
+Full-text search over conversation content.
+
+ - SQLite: FTS5 external-content table `conversations_fts` (unicode61 with
+   diacritics removed), kept in sync with `conversations` by triggers.
+ - Postgres: stored generated column `conversations.content_tsv`
+   (to_tsvector('spanish', unaccent(content))) with a GIN index, so rows the
+   bot inserts directly are indexed without any application code.
+
+Install with `flask search init` (SQLite installs itself on startup). Terms are
+matched as prefixes; Postgres also applies the Spanish stemmer, SQLite has no
+Spanish stemmer so prefix matching stands in for it. When the index is missing
+callers fall back to ILIKE.
+"""
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from models import db, Conversation
+
+_available = None
+
+# Control characters as highlight delimiters so the snippet can be escaped
+# first and turned into <mark> afterwards.
+_HL_START, _HL_END = "\x02", "\x03"
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5("
+    " content, content='conversations', content_rowid='id',"
+    " tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN"
+    " INSERT INTO conversations_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN"
+    " INSERT INTO conversations_fts(conversations_fts, rowid, content)"
+    " VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF content ON conversations BEGIN"
+    " INSERT INTO conversations_fts(conversations_fts, rowid, content)"
+    " VALUES ('delete', old.id, old.content);"
+    " INSERT INTO conversations_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() is only STABLE; generated columns and indexes need IMMUTABLE
+    "CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text"
+    " LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT"
+    " AS $$ SELECT public.unaccent('public.unaccent', $1) $$",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS content_tsv tsvector"
+    " GENERATED ALWAYS AS (to_tsvector('spanish', immutable_unaccent(coalesce(content, '')))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_conversations_content_tsv ON conversations USING GIN (content_tsv)",
+]
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def install(rebuild=False):
+    """Create the full-text index for the current backend (idempotent).
+
+    On Postgres adding the generated column rewrites `conversations` once;
+    run it from the CLI, not on a request.
+    """
+    global _available
+    dialect = _dialect()
+    if dialect == "sqlite":
+        existed = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'conversations_fts'"
+        )).first() is not None
+        for stmt in _SQLITE_DDL:
+            db.session.execute(text(stmt))
+        if rebuild or not existed:
+            db.session.execute(text("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for stmt in _POSTGRES_DDL:
+            db.session.execute(text(stmt))
+    else:
+        raise NotImplementedError(f"full-text search not supported on {dialect}")
+    db.session.commit()
+    _available = None
+
+
+def available() -> bool:
+    """True if the full-text index exists (checked once per process)."""
+    global _available
+    if _available is None:
+        dialect = _dialect()
+        if dialect == "sqlite":
+            sql = "SELECT 1 FROM sqlite_master WHERE name = 'conversations_fts'"
+        elif dialect == "postgresql":
+            sql = ("SELECT 1 FROM information_schema.columns"
+                   " WHERE table_name = 'conversations' AND column_name = 'content_tsv'")
+        else:
+            sql = None
+        try:
+            _available = bool(sql) and db.session.execute(text(sql)).first() is not None
+        except Exception:
+            db.session.rollback()
+            _available = False
+    return _available
+
+
+def _terms(q):
+    return re.findall(r"\w+", q or "", flags=re.UNICODE)[:8]
+
+
+def _match_clause():
+    """(FROM/JOIN fragment, WHERE fragment, rank expr, snippet expr) for the backend."""
+    if _dialect() == "sqlite":
+        return (
+            "JOIN conversations_fts f ON f.rowid = c.id",
+            "conversations_fts MATCH :query",
+            "f.rank",
+            f"snippet(conversations_fts, 0, '{_HL_START}', '{_HL_END}', '…', 16)",
+        )
+    return (
+        "",
+        "c.content_tsv @@ to_tsquery('spanish', immutable_unaccent(:query))",
+        "-ts_rank(c.content_tsv, to_tsquery('spanish', immutable_unaccent(:query)))",
+        "ts_headline('spanish', c.content, to_tsquery('spanish', immutable_unaccent(:query)),"
+        f" 'StartSel={_HL_START}, StopSel={_HL_END}, MaxWords=20, MinWords=8')",
+    )
+
+
+def _query_string(terms):
+    if _dialect() == "sqlite":
+        return " ".join(f'"{t}"*' for t in terms)
+    return " & ".join(f"{t}:*" for t in terms)
+
+
+def highlight(snippet) -> Markup:
+    """Escape a snippet and turn the highlight delimiters into <mark> tags."""
+    safe = str(escape(snippet or ""))
+    return Markup(safe.replace(_HL_START, "<mark>").replace(_HL_END, "</mark>"))
+
+
+def search(q, limit=20, role="user"):
+    """Best-ranked conversation rows matching q, with highlighted snippets.
+
+    Returns dicts: id, user_id, role, created_at, snippet (Markup). Empty when
+    the index isn't installed or q has no searchable terms.
+    """
+    terms = _terms(q)
+    if not terms or not available():
+        return []
+    join, where, rank, snippet = _match_clause()
+    params = {"query": _query_string(terms), "limit": limit}
+    if role:
+        where += " AND c.role = :role"
+        params["role"] = role
+    sql = text(
+        f"SELECT c.id, c.user_id, c.role, c.created_at, {snippet} AS snippet"
+        f" FROM conversations c {join}"
+        f" WHERE {where} ORDER BY {rank} LIMIT :limit"
+    ).columns(id=db.Integer, user_id=db.String, role=db.String,
+              created_at=db.DateTime, snippet=db.String)
+    rows = db.session.execute(sql, params)
+    return [
+        {"id": r.id, "user_id": r.user_id, "role": r.role, "created_at": r.created_at,
+         "snippet": highlight(r.snippet)}
+        for r in rows
+    ]
+
+
+def matching_user_ids(q, role="user"):
+    """Select of distinct user_ids with a message matching q (ILIKE fallback)."""
+    terms = _terms(q)
+    if terms and available():
+        join, where, _, _ = _match_clause()
+        return (
+            text(f"SELECT DISTINCT c.user_id FROM conversations c {join}"
+                 f" WHERE {where} AND c.role = :role")
+            .bindparams(query=_query_string(terms), role=role)
+            .columns(user_id=db.String)
+        )
+    return (
+        db.select(Conversation.user_id)
+        .where(Conversation.role == role, Conversation.content.ilike(f"%{q}%"))
+        .distinct()
+    )
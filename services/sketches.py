@@ -0,0 +1,78 @@
+"""
+Approximate distinct users over any date range.
+
+The "user_sketches" job keeps one HyperLogLog sketch per day of the users who
+wrote that day (conversation_user_sketches, ~4 KiB/day). A range count merges
+the day sketches — a month is ~30 register-wise maxes instead of a DISTINCT
+over every message — plus the not-yet-sketched tail. Error bound: see
+services.hll (≈1.6% standard error at the default precision).
+"""
+from collections import defaultdict
+from models import db, Conversation, ConversationUserSketch
+from services import incremental
+from services.hll import HyperLogLog
+
+JOB = "user_sketches"
+
+
+def _process(rows):
+    by_day = defaultdict(set)
+    for r in rows:
+        if r.role == "user" and r.created_at is not None:
+            by_day[r.created_at.date()].add(r.user_id)
+    if not by_day:
+        return
+    # Read-modify-write is safe: batches of a job are claimed one at a time
+    existing = {
+        s.day: s for s in
+        ConversationUserSketch.query.filter(ConversationUserSketch.day.in_(list(by_day))).all()
+    }
+    for day, users in by_day.items():
+        row = existing.get(day)
+        sketch = HyperLogLog.from_bytes(row.registers) if row else HyperLogLog()
+        sketch.update(users)
+        if row:
+            row.registers = sketch.to_bytes()
+        else:
+            db.session.add(ConversationUserSketch(day=day, registers=sketch.to_bytes()))
+
+
+def _reset():
+    db.session.query(ConversationUserSketch).delete()
+
+
+incremental.register(JOB, _process, _reset)
+
+
+# ── Readers ───────────────────────────────────────────────
+
+def sketch(start=None, end=None) -> HyperLogLog:
+    """Merged sketch of users with a message in [start, end) (datetimes)."""
+    S = ConversationUserSketch
+    # Watermark first: a catch-up committing before the registers are read
+    # then overlaps the tail instead of leaving a gap, and adding a user
+    # twice doesn't change a sketch
+    last_id = incremental.watermark(JOB)
+    q = db.session.query(S.registers)
+    if start is not None:
+        q = q.filter(S.day >= start.date())
+    if end is not None:
+        q = q.filter(S.day < end.date())
+    merged = HyperLogLog()
+    for (registers,) in q.all():
+        merged.merge(HyperLogLog.from_bytes(registers))
+
+    tail = db.session.query(Conversation.user_id).filter(
+        Conversation.role == "user", Conversation.id > last_id
+    )
+    if start is not None:
+        tail = tail.filter(Conversation.created_at >= start)
+    if end is not None:
+        tail = tail.filter(Conversation.created_at < end)
+    merged.update(uid for (uid,) in tail.distinct())
+    return merged
+
+
+def distinct_users(start=None, end=None) -> int:
+    """Approximate count of users with a message in [start, end)."""
+    return sketch(start, end).count()
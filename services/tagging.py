@@ -0,0 +1,93 @@
+"""
+Write-time intent tagging of conversation rows.
+
+Each user message is scanned once by an accent-insensitive Aho-Corasick
+matcher and every matching tag is stored in `conversation_tags`, so "who
+asked about RRPP" becomes an indexed lookup instead of one ILIKE per keyword
+over the whole table. Maintained by the "tags" incremental job; rebuild with
+`flask jobs rebuild tags` after changing the keyword lists.
+"""
+from models import db, Conversation, ConversationTag
+from services import incremental
+from services.text_match import Matcher
+
+JOB = "tags"
+
+TAG_RRPP = "rrpp"
+
+RRPP_KEYWORDS = [
+    'rrpp', 'promotor', 'promotora', 'comision', 'comisiones',
+    'ganar dinero', 'equipo', 'reclutar', 'relaciones publicas',
+    'codigo', 'enlace', 'rangos', 'puntos', 'ser rrpp',
+    'quiero ser', 'trabajar', 'sueldo', 'beneficios'
+]
+
+TAG_KEYWORDS = {
+    TAG_RRPP: RRPP_KEYWORDS,
+}
+
+_matcher = Matcher({kw: tag for tag, kws in TAG_KEYWORDS.items() for kw in kws})
+
+
+def tags_for(text: str) -> set:
+    """Tags whose keywords appear in text."""
+    return _matcher.labels(text)
+
+
+def _process(rows):
+    tagged = [
+        {"tag": tag, "conversation_id": r.id, "user_id": r.user_id}
+        for r in rows if r.role == "user"
+        for tag in tags_for(r.content)
+    ]
+    incremental.upsert(ConversationTag, tagged, keys=("tag", "conversation_id"))
+
+
+def _reset():
+    db.session.query(ConversationTag).delete()
+
+
+incremental.register(JOB, _process, _reset)
+
+
+# ── Readers ───────────────────────────────────────────────
+
+def tagged_messages(tag):
+    """Query of user Conversation rows carrying tag (tagged rows only)."""
+    return (
+        Conversation.query
+        .join(ConversationTag, ConversationTag.conversation_id == Conversation.id)
+        .filter(ConversationTag.tag == tag)
+    )
+
+
+def count_users(tag):
+    """(distinct users with at least one message tagged `tag`, stale).
+
+    Rows newer than the job's watermark are matched in Python so the count
+    doesn't lag behind the tagger. With more than incremental.TAIL_MAX_ROWS
+    of them only the tagged rows count and stale is True.
+    """
+    # Watermark first: a catch-up committing meanwhile overlaps the tail, and
+    # a user found on both sides is counted once
+    last_id = incremental.watermark(JOB)
+    tagged = (
+        db.session.query(db.func.count(db.func.distinct(ConversationTag.user_id)))
+        .filter(ConversationTag.tag == tag)
+        .scalar()
+    ) or 0
+    rows = incremental.tail_rows(
+        db.session.query(Conversation.user_id, Conversation.content).filter(Conversation.role == "user"),
+        last_id,
+    )
+    if rows is None:
+        return tagged, True
+    tail_users = {r.user_id for r in rows if tag in tags_for(r.content)}
+    if not tail_users:
+        return tagged, False
+    known = {
+        r[0] for r in db.session.query(ConversationTag.user_id).filter(
+            ConversationTag.tag == tag, ConversationTag.user_id.in_(tail_users)
+        ).distinct()
+    }
+    return tagged + len(tail_users - known), False
@@ -0,0 +1,81 @@
+"""
+Single-pass multi-pattern substring matching (Aho-Corasick).
+
+Text and patterns are normalized the same way — lowercased, accents stripped
+("Comisión" → "comision") — so one scan over a message finds every pattern it
+contains, whatever the number of patterns.
+"""
+import unicodedata
+from collections import deque
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip diacritics (ñ → n, á → a)."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+class Matcher:
+    """Aho-Corasick automaton over a mapping of pattern -> label.
+
+    Several patterns may share a label (e.g. all RRPP keywords → "rrpp").
+    """
+
+    def __init__(self, patterns):
+        if not isinstance(patterns, dict):
+            patterns = {p: p for p in patterns}
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        for pattern, label in patterns.items():
+            key = normalize(pattern)
+            if not key:
+                continue
+            node = 0
+            for ch in key:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                node = nxt
+            self._out[node].add(label)
+
+        # Breadth-first pass to wire failure links and merge outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def labels(self, text: str) -> set:
+        """Every label whose pattern occurs in text."""
+        found = set()
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in normalize(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+    def matches(self, text: str) -> bool:
+        """True if any pattern occurs in text."""
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in normalize(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                return True
+        return False
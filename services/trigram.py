@@ -0,0 +1,114 @@
+"""
+Indexed substring search ("contains q") for the list filters.
+
+`ILIKE '%q%'` can't use a B-tree index, so every list search was a full scan.
+ - Postgres: pg_trgm GIN indexes on the searched columns; the planner uses
+   them for the same ILIKE, so the filter itself doesn't change.
+ - SQLite: an FTS5 `trigram` external-content table per model
+   (`<table>_trgm`, kept in sync by triggers); a phrase query on it is a
+   case-insensitive substring match served by the index.
+
+Trigrams need at least 3 characters, so shorter queries (and tables whose
+index isn't installed) fall back to ILIKE. Install with `flask search init`
+(SQLite installs itself on startup).
+"""
+from sqlalchemy import text
+from models import db, Client, ConversationUser, Event, User, Venue
+
+# model -> searchable columns
+INDEXED = {
+    Client: ("name", "phone", "chat_id"),
+    Event: ("name", "venue", "description"),
+    Venue: ("name", "address"),
+    User: ("email", "name"),
+    ConversationUser: ("user_id",),
+}
+MIN_CHARS = 3
+
+_available: dict = {}
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _sqlite_ddl(table, columns):
+    fts = f"{table}_trgm"
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old});"
+    insert = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f" {cols}, content='{table}', content_rowid='rowid', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN"
+        f" {delete} {insert} END",
+    ]
+
+
+def _postgres_ddl(table, columns):
+    return [
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_{c}_trgm ON {table} USING GIN ({c} gin_trgm_ops)"
+        for c in columns
+    ]
+
+
+def install(rebuild=False):
+    """Create the trigram indexes for the current backend (idempotent)."""
+    dialect = _dialect()
+    if dialect == "postgresql":
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    elif dialect != "sqlite":
+        raise NotImplementedError(f"trigram search not supported on {dialect}")
+    for model, columns in INDEXED.items():
+        table = model.__tablename__
+        if dialect == "postgresql":
+            for stmt in _postgres_ddl(table, columns):
+                db.session.execute(text(stmt))
+            continue
+        existed = _sqlite_exists(table)
+        for stmt in _sqlite_ddl(table, columns):
+            db.session.execute(text(stmt))
+        if rebuild or not existed:
+            db.session.execute(text(f"INSERT INTO {table}_trgm({table}_trgm) VALUES ('rebuild')"))
+    db.session.commit()
+    _available.clear()
+
+
+def _sqlite_exists(table):
+    return db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": f"{table}_trgm"}
+    ).first() is not None
+
+
+def available(model) -> bool:
+    """True if `model` has a SQLite trigram table (checked once per process)."""
+    table = model.__tablename__
+    if table not in _available:
+        try:
+            _available[table] = _dialect() == "sqlite" and model in INDEXED and _sqlite_exists(table)
+        except Exception:
+            db.session.rollback()
+            _available[table] = False
+    return _available[table]
+
+
+def contains(q, *columns):
+    """Clause: any of `columns` (attributes of one model) contains q, ignoring case."""
+    q = (q or "").strip()
+    model = columns[0].class_
+    names = [c.key for c in columns]
+    if (
+        len(q) >= MIN_CHARS
+        and available(model)
+        and set(names) <= set(INDEXED[model])
+    ):
+        table = model.__tablename__
+        phrase = '"' + q.replace('"', '""') + '"'
+        return text(
+            f"{table}.rowid IN (SELECT rowid FROM {table}_trgm WHERE {table}_trgm MATCH :trgm_q)"
+        ).bindparams(db.bindparam("trgm_q", f"{{{' '.join(names)}}}: {phrase}", unique=True))
+    return db.or_(*(c.ilike(f"%{q}%") for c in columns))
@@ -0,0 +1,148 @@
+"""
+Write-behind queue with group commit for POST /api/messages.
+
+With MESSAGES_WRITE_BEHIND=1 a validated message is put on a bounded
+in-process queue and acknowledged with 202 instead of being committed inside
+the request. A single writer thread flushes the queue every FLUSH_MS
+milliseconds or every FLUSH_ROWS rows, whichever comes first, with one
+multi-row INSERT and one commit (services.ingest.insert), so a burst of
+replies costs a handful of transactions on one pooled connection instead of
+one transaction and one connection per request.
+
+When the queue is full `submit` waits up to PUT_TIMEOUT seconds and then
+raises `QueueFull`; the endpoint answers 503 with Retry-After so the caller
+backs off. On shutdown (atexit) the writer drains whatever is still queued.
+
+Acknowledged rows live only in memory until flushed, so a hard kill loses at
+most one queue's worth. Not for serverless deployments (VERCEL is set), where
+the process is frozen between requests; there the mode stays off.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from services import ingest
+
+ENABLED = (
+    os.getenv("MESSAGES_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+    and not os.getenv("VERCEL")
+)
+MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "5000"))
+FLUSH_ROWS = int(os.getenv("WRITE_BEHIND_FLUSH_ROWS", "200"))
+FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "250"))
+PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "0.5"))  # seconds a full queue may block a request
+RETRIES = 3
+DRAIN_TIMEOUT = 30  # seconds the exit handler waits for the last flush
+
+_queue = queue.Queue(maxsize=MAX_QUEUE)
+_stop = threading.Event()
+_writer = None
+_writer_lock = threading.Lock()
+_counters = {"accepted": 0, "written": 0, "failed": 0, "flushes": 0, "rejected": 0}
+_counters_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """The queue is at MAX_QUEUE; the caller should retry later."""
+
+
+def _count(name, n=1):
+    with _counters_lock:
+        _counters[name] += n
+
+
+# ── Writer ─────────────────────────────────────────────────
+
+def _next_batch():
+    """Block for the first row, then collect until FLUSH_ROWS or FLUSH_MS."""
+    try:
+        batch = [_queue.get(timeout=1)]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + FLUSH_MS / 1000
+    while len(batch) < FLUSH_ROWS:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 and not _stop.is_set():
+            break
+        try:
+            batch.append(_queue.get(timeout=max(remaining, 0)) if remaining > 0 else _queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _write(app, batch):
+    """Insert one group; after RETRIES failures fall back to row by row so a
+    bad row only costs itself."""
+    with app.app_context():
+        for attempt in range(RETRIES):
+            try:
+                _count("written", ingest.insert("messages", batch))
+                _count("flushes")
+                return
+            except Exception as e:
+                print(f"[WARNING] Write-behind flush of {len(batch)} messages failed: {e}")
+                time.sleep(0.5 * 2 ** attempt)
+        for row in batch:
+            try:
+                _count("written", ingest.insert("messages", [row]))
+            except Exception as e:
+                _count("failed")
+                print(f"[WARNING] Write-behind dropped message from {row.get('user_id')}: {e}")
+
+
+def _run(app):
+    while not (_stop.is_set() and _queue.empty()):
+        batch = _next_batch()
+        if batch:
+            try:
+                _write(app, batch)
+            finally:
+                for _ in batch:
+                    _queue.task_done()
+
+
+def _ensure_writer(app):
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None or not _writer.is_alive():
+                _stop.clear()
+                _writer = threading.Thread(target=_run, args=(app,), name="write-behind", daemon=True)
+                _writer.start()
+
+
+# ── Public API ────────────────────────────────────────────
+
+def submit(app, row):
+    """Queue a validated message row (see ingest.validate); QueueFull if no room."""
+    _ensure_writer(app)
+    try:
+        _queue.put(row, timeout=PUT_TIMEOUT)
+    except queue.Full:
+        _count("rejected")
+        raise QueueFull(f"write-behind queue is full ({MAX_QUEUE} rows)")
+    _count("accepted")
+
+
+def stats() -> dict:
+    with _counters_lock:
+        return {**_counters, "pending": _queue.qsize(), "max_queue": MAX_QUEUE}
+
+
+def drain(timeout=DRAIN_TIMEOUT) -> bool:
+    """Flush everything queued and stop the writer; True if the queue
+    emptied within `timeout` seconds."""
+    writer = _writer
+    if writer is None or not writer.is_alive():
+        return _queue.empty()
+    _stop.set()
+    writer.join(timeout)
+    if writer.is_alive() or not _queue.empty():
+        print(f"[WARNING] Write-behind drain timed out with {_queue.qsize()} messages unwritten")
+        return False
+    return True
+
+
+atexit.register(drain)
@@ -354,3 +354,144 @@ function checkTaskReminders() {
         });
     });
 })();
+
+// ═══ ASYNC WIDGETS ═══════════════════════════════════════════════════════════
+// Pages render a skeleton; every element with data-widget="<name>" is filled
+// from <base><name> (JSON). [data-field] children get the matching value and
+// renderers[name](data) draws anything richer (charts, lists). Widgets load in
+// parallel, so a slow one never holds back the others. The endpoints send
+// ETags, so a reload of unchanged data is a 304.
+
+function escapeHtml(s) {
+    return String(s == null ? '' : s)
+        .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
+// "45s", "12m", "3h", "2d" — same format as the server used to render
+function shortAgo(iso) {
+    var s = Math.max(0, Math.floor((Date.now() - new Date(iso).getTime()) / 1000));
+    if (s < 60) return s + 's';
+    if (s < 3600) return Math.floor(s / 60) + 'm';
+    if (s < 86400) return Math.floor(s / 3600) + 'h';
+    return Math.floor(s / 86400) + 'd';
+}
+
+function fillWidget(root, data) {
+    root.querySelectorAll('[data-field]').forEach(function(el) {
+        var key = el.getAttribute('data-field');
+        if (key in data) el.textContent = data[key];
+    });
+    root.classList.remove('is-loading');
+}
+
+function loadWidgets(base, renderers) {
+    var names = {};
+    document.querySelectorAll('[data-widget]').forEach(function(el) {
+        names[el.getAttribute('data-widget')] = true;
+    });
+    Object.keys(names).forEach(function(name) {
+        var roots = document.querySelectorAll('[data-widget="' + name + '"]');
+        fetch(base + name, { credentials: 'same-origin' })
+            .then(function(r) {
+                if (!r.ok) throw new Error(r.status);
+                return r.json();
+            })
+            .then(function(data) {
+                roots.forEach(function(root) { fillWidget(root, data); });
+                if (renderers && renderers[name]) renderers[name](data);
+            })
+            .catch(function() {
+                roots.forEach(function(root) {
+                    root.querySelectorAll('[data-field]').forEach(function(el) { el.textContent = '—'; });
+                    root.querySelectorAll('.widget-skeleton').forEach(function(el) {
+                        el.outerHTML = '<div class="ai-error"><p>No se pudieron cargar los datos</p></div>';
+                    });
+                    root.classList.remove('is-loading');
+                });
+            });
+    });
+}
+
+// Upcoming-event cards ({name, venue, theme, day, month}); meta(e) returns the
+// HTML under the name, defaults to "venue · theme".
+function renderUpcomingEvents(el, events, emptyHtml, meta) {
+    if (!events || !events.length) {
+        el.innerHTML = emptyHtml;
+        return;
+    }
+    meta = meta || function(e) {
+        return '📍 ' + escapeHtml(e.venue) + (e.theme
+            ? ' · <span class="badge" style="padding:2px 6px;font-size:10px;background:rgba(59,130,246,0.1);color:var(--brand-primary);border:1px solid rgba(59,130,246,0.2)">' + escapeHtml(e.theme) + '</span>'
+            : '');
+    };
+    el.innerHTML = '<div class="upcoming-events">' + events.map(function(e) {
+        return '<div class="upcoming-event-card">'
+            + '<div class="upcoming-event-date"><div class="day">' + escapeHtml(e.day) + '</div>'
+            + '<div class="month">' + escapeHtml(e.month) + '</div></div>'
+            + '<div class="upcoming-event-info"><div class="upcoming-event-name">' + escapeHtml(e.name) + '</div>'
+            + '<div class="upcoming-event-meta">' + meta(e) + '</div></div>'
+            + '</div>';
+    }).join('') + '</div>';
+}
+
+// ═══ INFINITE SCROLL ═════════════════════════════════════════════════════════
+// <div data-infinite-scroll="#tbody" data-next="/url?cursor=..."> appends the
+// next page when it scrolls into view (or its button is clicked). The endpoint
+// answers {html, next}; the element removes itself after the last page.
+// With data-prepend the element sits at the top of a scrollable target (a chat
+// loading older messages): pages go in right below it and the scroll position
+// is kept.
+
+function initInfiniteScroll(el) {
+    var target = document.querySelector(el.getAttribute('data-infinite-scroll'));
+    var prepend = el.hasAttribute('data-prepend');
+    var button = el.querySelector('button');
+    var loading = false;
+
+    function loadMore() {
+        var url = el.getAttribute('data-next');
+        if (loading || !url) return;
+        loading = true;
+        if (button) button.disabled = true;
+        fetch(url, { credentials: 'same-origin' })
+            .then(function(r) {
+                if (!r.ok) throw new Error(r.status);
+                return r.json();
+            })
+            .then(function(data) {
+                if (prepend) {
+                    var height = target.scrollHeight;
+                    el.insertAdjacentHTML('afterend', data.html);
+                    target.scrollTop += target.scrollHeight - height;
+                } else {
+                    target.insertAdjacentHTML('beforeend', data.html);
+                }
+                if (data.next) {
+                    el.setAttribute('data-next', data.next);
+                    // Re-observe so a sentinel that is still visible loads the next page too
+                    if (observer) { observer.unobserve(el); observer.observe(el); }
+                } else {
+                    if (observer) observer.disconnect();
+                    el.remove();
+                }
+            })
+            .catch(function() {
+                if (observer) observer.disconnect();  // fall back to the button
+            })
+            .then(function() {
+                loading = false;
+                if (button) button.disabled = false;
+            });
+    }
+
+    var observer = 'IntersectionObserver' in window
+        ? new IntersectionObserver(function(entries) {
+            if (entries.some(function(e) { return e.isIntersecting; })) loadMore();
+        }, { root: prepend ? target : null, rootMargin: '400px' })
+        : null;
+    if (observer) observer.observe(el);
+    if (button) button.addEventListener('click', loadMore);
+}
+
+document.querySelectorAll('[data-infinite-scroll]').forEach(initInfiniteScroll);